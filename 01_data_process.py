@@ -1,6 +1,12 @@
 import csv
+import hashlib
 import json
 import os, re
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from context_store import get_store, parse_context_ids
+from data_io import is_score_file, iter_records, write_jsonl
 
 def get_file_names(directory):
     # 获取目录下的所有文件和文件夹
@@ -11,76 +17,332 @@ def get_file_names(directory):
 
 
 
-def data_process(csv_filename):
+def build_entry(row, is_baseline, store=None):
+    """ Converts one CSV row into a processed entry. With a context store, contexts are referenced by ID. """
+    # Process the question by combining title and body
+    question_title = row["Question Title"].strip()
+    question_body = row["Question Body"].strip()
+
+    if question_body:
+        question = f"{question_title} - {question_body}"
+    else:
+        question = question_title  # Use title only if body is empty
+
+    # Ensure retrieved contexts are formatted as an array of strings
+    if is_baseline:
+        retrieved_contexts = []  # Baseline（test_0）没有 retrieved_contexts
+    else:
+        retrieved_contexts = [
+            row["gpt_Top_1_Context"].strip(),
+            row["gpt_Top_2_Context"].strip(),
+            row["gpt_Top_3_Context"].strip()
+        ]
+        # Filter out empty contexts (in case some are missing)
+        retrieved_contexts = [context for context in retrieved_contexts if context]
+
+    # Intern contexts: gpt_Context_IDs lines up with gpt_Top_1..3_Context, each chunk is stored once per corpus
+    contexts_field = {"retrieved_contexts": retrieved_contexts}  # Now correctly formatted as a list
+    if store is not None and not is_baseline:
+        context_ids = parse_context_ids(row.get("gpt_Context_IDs", ""))
+        top_contexts = [row[f"gpt_Top_{k}_Context"].strip() for k in (1, 2, 3)]
+        if len(context_ids) == len(top_contexts):
+            contexts_field = {"context_ids": [store.add(i, c) for i, c in zip(context_ids, top_contexts) if c]}
+
+    # Construct the JSON entry
+    return {
+        "question_id": row.get("Question ID", "").strip(),  # 用于跨版本对齐（delta / 断点续跑）
+        "answer_id": row.get("Answer ID", "").strip(),
+        "question": question,
+        **contexts_field,
+        "generated_response": row["gpt_Refined_Response"].strip(),
+        "reference_answer": row["Answer Body"].strip() if row["Answer Body"].strip() else None,  # Set to None if empty
+    }
+
+
+def iter_entries(csv_path, store=None):
+    """ Generator: reads the CSV row by row and yields processed entries, never holding the whole file. """
+    # 判断是否为 Baseline（test_0.csv）
+    is_baseline = re.search(r'test_0\.csv$', csv_path) is not None  # 如果文件名是 `test_0.csv`，则是 Baseline
+
+    with open(csv_path, "r", encoding="utf-8") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            yield build_entry(row, is_baseline, store)
+
+
+def data_process(csv_filename, output_format="json", directory="./dev_data", columnar=False, intern_contexts=False):
     # Input CSV file
     # csv_filename = "input_data.csv"
 
+    # output_format="jsonl" streams one JSON object per line, memory stays flat for any input size
+    if output_format == "jsonl":
+        return data_process_jsonl(csv_filename, directory, columnar, intern_contexts)
+
     # Output JSON file
     json_filename = csv_filename.split(".")[0] + "processed_data.json"
-    csv_filename = "./dev_data/" + csv_filename
+    csv_filename = directory + "/" + csv_filename
 
     print(f"Processing: {csv_filename}")
 
-    # 判断是否为 Baseline（test_0.csv）
-    is_baseline = re.search(r'test_0\.csv$', csv_filename) is not None  # 如果文件名是 `test_0.csv`，则是 Baseline
-
     # Read CSV and convert to JSON format
-    data = []
+    store = get_store() if intern_contexts else None
+    data = list(iter_entries(csv_filename, store))
 
-    with open(csv_filename, "r", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
+    # Save to JSON file（先写临时文件再替换，和 save_manifest 一样）
+    tmp_filename = json_filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as jsonfile:
+        json.dump(data, jsonfile, indent=4, ensure_ascii=False)
+    os.replace(tmp_filename, json_filename)
 
-        for row in reader:
-            # Process the question by combining title and body
-            question_title = row["Question Title"].strip()
-            question_body = row["Question Body"].strip()
-            
-            if question_body:
-                question = f"{question_title} - {question_body}"
-            else:
-                question = question_title  # Use title only if body is empty
-
-            # Ensure retrieved contexts are formatted as an array of strings
-            if is_baseline:
-                retrieved_contexts = []  # Baseline（test_0）没有 retrieved_contexts
-            else: 
-                retrieved_contexts = [
-                    row["gpt_Top_1_Context"].strip(),
-                    row["gpt_Top_2_Context"].strip(),
-                    row["gpt_Top_3_Context"].strip()
-                ]
-                # Filter out empty contexts (in case some are missing)
-                retrieved_contexts = [context for context in retrieved_contexts if context]
-
-            # Construct the JSON entry
-            entry = {
-                "question": question,
-                "retrieved_contexts": retrieved_contexts,  # Now correctly formatted as a list
-                "generated_response": row["gpt_Refined_Response"].strip(),
-                "reference_answer": row["Answer Body"].strip() if row["Answer Body"].strip() else None,  # Set to None if empty
-            }
-            
-            data.append(entry)
+    print(f"01 Data processing completed. Output saved to {json_filename}")
+    if columnar:
+        build_columnar_cache(json_filename)
+    return json_filename
 
 
-    # Save to JSON file
-    with open(json_filename, "w", encoding="utf-8") as jsonfile:
-        json.dump(data, jsonfile, indent=4, ensure_ascii=False)
+def data_process_jsonl(csv_filename, directory="./dev_data", columnar=False, intern_contexts=False):
+    """ Streaming version of data_process: writes `<name>processed_data.jsonl`, one entry per line. """
+    jsonl_filename = csv_filename.split(".")[0] + "processed_data.jsonl"
+    csv_filename = directory + "/" + csv_filename
 
-    print(f"01 Data processing completed. Output saved to {json_filename}")
+    print(f"Processing (streaming): {csv_filename}")
+
+    store = get_store() if intern_contexts else None
+    count = write_jsonl(iter_entries(csv_filename, store), jsonl_filename)
+
+    print(f"01 Data processing completed. {count} rows streamed to {jsonl_filename}")
+    if columnar:
+        build_columnar_cache(jsonl_filename)
+    return jsonl_filename
+
+
+def build_columnar_cache(filename):
+    """ Emits `<filename>.cols/`, the memory-mapped columnar form that 02/03/04 read instead of re-parsing JSON. """
+    from columnar_cache import write_columnar
+
+    # context_ids 保持原样不解析，缓存里不再内联一份上下文全文
+    path = write_columnar(iter_records(filename, resolve=False), filename)
+    print(f"01 Columnar cache saved to {path}")
+    return path
+
+
+def cache_score_files(directory="./score_data"):
+    """ Builds (or refreshes) the columnar cache of every score file in `directory`. """
+    from columnar_cache import is_fresh
+
+    for file in get_file_names(directory):
+        if not is_score_file(file):
+            continue
+        filename = os.path.join(directory, file)
+        if is_fresh(filename):
+            print(f"Columnar cache up to date: {filename}")
+            continue
+        build_columnar_cache(filename)
+
+
+# Field groups compared between two RAG versions of the same Question ID / Answer ID
+DELTA_FIELDS = {
+    "question": ["question"],
+    "contexts": ["retrieved_contexts"],
+    "response": ["generated_response"],
+    "reference": ["reference_answer"],
+}
+
+
+def row_key(entry):
+    return f"{entry['question_id']}/{entry['answer_id']}"
+
+
+def row_hashes(entry):
+    """ One short hash per field group, so only hashes (not texts) of the previous version are kept in memory. """
+    return {
+        group: hashlib.sha1(json.dumps([entry[f] for f in fields], ensure_ascii=False).encode("utf-8")).hexdigest()
+        for group, fields in DELTA_FIELDS.items()
+    }
+
+
+def data_delta(csv_filename, previous_csv_filename, directory="./dev_data"):
+    """
+    Compares `csv_filename` with a previous version row by row (keyed by Question ID / Answer ID)
+    and streams only new or changed rows to `<name>delta_data.jsonl`.
+    Each delta entry carries "changed": the field groups that differ, or ["new"].
+    """
+    delta_filename = csv_filename.split(".")[0] + "delta_data.jsonl"
+    print(f"Delta: {directory}/{csv_filename} vs {directory}/{previous_csv_filename}")
+
+    previous = {row_key(entry): row_hashes(entry) for entry in iter_entries(directory + "/" + previous_csv_filename)}
+    stats = {"total": 0, "changed": 0, "new": 0}
+    seen = set()
+
+    def changed_entries():
+        for entry in iter_entries(directory + "/" + csv_filename):
+            key = row_key(entry)
+            seen.add(key)
+            stats["total"] += 1
+            old_hashes = previous.get(key)
+            if old_hashes is None:
+                stats["new"] += 1
+                entry["changed"] = ["new"]
+                yield entry
+                continue
+            hashes = row_hashes(entry)
+            changed = [group for group in DELTA_FIELDS if hashes[group] != old_hashes[group]]
+            if changed:
+                stats["changed"] += 1
+                entry["changed"] = changed
+                yield entry
+
+    count = write_jsonl(changed_entries(), delta_filename)
+    removed = len(set(previous) - seen)
+
+    print(f"01 Delta completed: {count}/{stats['total']} rows to re-score "
+          f"({stats['changed']} changed, {stats['new']} new, {removed} removed). Output saved to {delta_filename}")
+    return delta_filename
+
+
+# Manifest of processed inputs: {csv file: {"size", "mtime_ns", "sha256", "output"}}
+MANIFEST_FILENAME = "processed_manifest.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """ Content hash of an input file, read in chunks. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_filename=MANIFEST_FILENAME):
+    if not os.path.exists(manifest_filename):
+        return {}
+    with open(manifest_filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_filename=MANIFEST_FILENAME):
+    # 先写临时文件再替换，避免中途退出留下半个 manifest
+    tmp_filename = manifest_filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_filename, manifest_filename)
+
+
+def is_unchanged(csv_path, record):
+    """ Returns (unchanged, sha256). size + mtime match skips hashing; otherwise the content hash decides. """
+    if not record or not os.path.exists(record.get("output", "")):
+        return False, None
+    stat = os.stat(csv_path)
+    if stat.st_size == record.get("size") and stat.st_mtime_ns == record.get("mtime_ns"):
+        return True, record["sha256"]
+    sha256 = file_sha256(csv_path)
+    return sha256 == record.get("sha256"), sha256
+
+
+def _process_one(csv_filename, output_format, directory, columnar, intern_contexts):
+    """ Worker entry for the process pool, returns (file, output, error). """
+    try:
+        return csv_filename, data_process(csv_filename, output_format=output_format, directory=directory, columnar=columnar,
+                                          intern_contexts=intern_contexts), None
+    except Exception as e:
+        return csv_filename, None, f"{type(e).__name__}: {e}"
+
+
+def batch_process(directory="./dev_data", workers=None, output_format="jsonl", manifest_filename=MANIFEST_FILENAME,
+                  columnar=False, intern_contexts=False):
+    """ Converts every CSV in `directory` over a process pool, skipping files unchanged since the last run. """
+    manifest = load_manifest(manifest_filename)
+    csv_files = sorted(f for f in get_file_names(directory) if f.endswith(".csv"))
+
+    pending = {}
+    touched = False
+    for file in csv_files:
+        csv_path = os.path.join(directory, file)
+        record = manifest.get(file)
+        # 格式变了（或缺少列式缓存 / context 引用方式不同）也要重新处理
+        if record and (record.get("format") != output_format or (columnar and not record.get("columnar"))
+                       or record.get("intern_contexts", False) != intern_contexts):
+            record = None
+        unchanged, sha256 = is_unchanged(csv_path, record)
+        if unchanged:
+            print(f"Skipping unchanged: {file}")
+            # Same content but touched: refresh stat so the next run skips without hashing
+            stat = os.stat(csv_path)
+            if (record["size"], record["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                record["size"], record["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+                touched = True
+            continue
+        pending[file] = sha256 or file_sha256(csv_path)
+
+    if touched:
+        save_manifest(manifest, manifest_filename)
+
+    if not pending:
+        print("01 Batch processing: nothing to do.")
+        return manifest
+
+    if intern_contexts:
+        # context_store.jsonl 是单个 append-only 文件，多进程同时追加会写乱 offset
+        workers = 1
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_process_one, file, output_format, directory, columnar, intern_contexts) for file in pending]
+        for future in as_completed(futures):
+            file, output, error = future.result()
+            if error:
+                print(f"Failed: {file} ({error})")
+                failed.append(file)
+                continue
+            stat = os.stat(os.path.join(directory, file))
+            manifest[file] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": pending[file],
+                "format": output_format,
+                "output": output,
+                "columnar": columnar,
+                "intern_contexts": intern_contexts,
+            }
+            # 每完成一个文件就落盘，中断后已完成的不会重跑
+            save_manifest(manifest, manifest_filename)
+
+    print(f"01 Batch processing completed: {len(pending) - len(failed)} converted, "
+          f"{len(csv_files) - len(pending)} skipped, {len(failed)} failed.")
+    return manifest
 
 
 if __name__ == "__main__":
-    directory_path = './dev_data'  # 替换为你的目标目录路径
-    file_names = get_file_names(directory_path)
-    print(file_names)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", action="store_true", help="process every CSV in ./dev_data incrementally")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["json", "jsonl"], default="jsonl")
+    parser.add_argument("--columnar", action="store_true", help="also emit the memory-mapped columnar cache")
+    parser.add_argument("--cache-scores", action="store_true", help="build columnar caches for ./score_data")
+    parser.add_argument("--intern-contexts", action="store_true",
+                        help="store contexts once in context_store.jsonl and reference them by gpt_Context_IDs")
+    parser.add_argument("--delta", nargs=2, metavar=("CSV", "PREVIOUS_CSV"),
+                        help="write only the rows of CSV that changed since PREVIOUS_CSV")
+    args = parser.parse_args()
+
+    if args.cache_scores:
+        cache_score_files("./score_data")
+    elif args.delta:
+        data_delta(*args.delta)
+    elif args.batch:
+        batch_process("./dev_data", workers=args.workers, output_format=args.format, columnar=args.columnar,
+                      intern_contexts=args.intern_contexts)
+    else:
+        directory_path = './dev_data'  # 替换为你的目标目录路径
+        file_names = get_file_names(directory_path)
+        print(file_names)
     
-    # 只处理 test_13.csv
-    test_13_file = "test_verification_results_v5.csv"
+        # 只处理 test_13.csv
+        test_13_file = "test_verification_results_v5.csv"
     
-    if test_13_file in file_names:
-        print(f"Processing only {test_13_file}...")
-        data_process(test_13_file)
+        if test_13_file in file_names:
+            print(f"Processing only {test_13_file}...")
+            data_process(test_13_file)
         
-    # for file in file_names:
-    #     data_process(file)
+        # for file in file_names:
+        #     data_process(file)
@@ -6,6 +6,14 @@ from ragas import evaluate
 import faulthandler
 faulthandler.enable()
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+import llm_telemetry
+from context_packing import merge_reports, pack_record, packing_report, report_filename, write_report
+from context_store import context_reference
+from data_io import ResultWriter, id_fields, iter_records, load_records
+from record_index import count_records
+from result_journal import ResultJournal, journal_filename, sample_key
 
 
 API_KEY= "YOUR_API"
@@ -15,21 +23,68 @@ os.environ["https_proxy"] = "http://localhost:7890"
 # os.environ["OPENAI_API_KEY"] = API_KEY
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
+# score_rag evaluates and journals this many rows at a time; a crash loses at most one chunk
+CHECKPOINT_EVERY = 20
+# 1 = answer_relevancy 的问题 embedding 从 reference_store 复用（默认关闭，走 ragas 自己的 embeddings）
+REUSE_QUESTION_EMBEDDINGS = os.getenv("REUSE_QUESTION_EMBEDDINGS", "0") == "1"
+
 
 def remove_backticks_content(text):
     # 使用正则表达式匹配被 ``` 包裹的内容，并替换为空字符串
     # re.DOTALL 标志确保 . 匹配包括换行符在内的所有字符
     return re.sub(r'```.*?```', '', text, flags=re.DOTALL)
 
-def score_faithfulness_rag(json_filename, output_filename):
+def score_key(item):
+    return f"{item['question_id']}/{item['answer_id']}"
+
+
+def merge_delta_scores(previous_scores_filename, delta_scores_filename, processed_filename, output_filename,
+                       limit=None):
+    """
+    Builds a full score file for a new RAG version from the previous version's scores plus the scores of
+    the delta rows (see 01 data_delta). Rows are matched by Question ID / Answer ID and written in the
+    order of `processed_filename`. Previous-score rows without IDs (files scored before IDs were added)
+    are matched by row position instead, when their question is the same.
+    """
+    previous_rows = load_records(previous_scores_filename, resolve=False)
+    previous = {score_key(item): item for item in previous_rows if "answer_id" in item}
+    delta = {score_key(item): item for item in load_records(delta_scores_filename, resolve=False)}
+    without_ids = len(previous_rows) - len(previous)
+    if without_ids:
+        print(f"Warning: {without_ids} previous-score rows have no Question ID / Answer ID; "
+              f"matching them by row position")
+
+    writer = ResultWriter(output_filename)
+    missing = []
+    by_position = 0
+    for position, item in enumerate(iter_records(processed_filename, limit=limit)):
+        key = score_key(item)
+        entry = delta.get(key) or previous.get(key)
+        if entry is None and position < len(previous_rows):
+            # 旧的分数文件没有 ID，但和输入文件逐行对应
+            candidate = previous_rows[position]
+            if "answer_id" not in candidate and candidate.get("question") == item.get("question"):
+                entry = candidate
+                by_position += 1
+        if entry is None:
+            missing.append(key)
+            continue
+        writer.write([entry])
+    total = writer.close()
+
+    if by_position:
+        print(f"{by_position} rows taken from the previous scores by row position")
+    if missing:
+        print(f"Warning: {len(missing)} rows have no score in either file, e.g. {missing[:3]}")
+    print(f"Merged {len(delta)} re-scored rows into {total} total. Output saved to {output_filename}")
+
+
+def score_faithfulness_rag(json_filename, output_filename, start=0, limit=100):
 
     
-    # Load processed JSON data
-    with open(json_filename, "r", encoding="utf-8") as jsonfile:
-        data = json.load(jsonfile)
-
-    # 取前 100 个元素
-    data = data[:100]
+    # Load processed JSON / JSONL data
+    # 默认取前 100 个元素；start/limit 通过 offset 索引只解析选中的行
+    data = load_records(json_filename, limit=limit, start=start)
 
     # 判断是否是 Baseline（如果所有 retrieved_contexts 都是 []，则为 Baseline）
     is_baseline = all(not item["retrieved_contexts"] for item in data)
@@ -77,8 +132,9 @@ def score_faithfulness_rag(json_filename, output_filename):
     scored_data = []
     for i in range(len(data)):
         entry = {
+            **id_fields(data[i]),
             "question": data[i]["question"],
-            "retrieved_contexts": data[i]["retrieved_contexts"],
+            **context_reference(data[i]),
             "generated_response": data[i]["generated_response"],
             "reference_answer": data[i]["reference_answer"],
             "faithfulness": scores["faithfulness"][i] if not is_baseline else 0.0, # 如果是baseline直接输出0.0
@@ -96,22 +152,42 @@ def score_faithfulness_rag(json_filename, output_filename):
     print(f"RAGAS scoring completed. Output saved to {output_filename}")
 
 
-def score_rag(json_filename, output_filename):
-    # Load processed JSON data
-    with open(json_filename, "r", encoding="utf-8") as jsonfile:
-        data = json.load(jsonfile)
-
-    # 取前 100 个元素
-    data = data[:100]
+def score_rag(json_filename, output_filename, start=0, limit=100, is_baseline=None, resume=False,
+              checkpoint_every=CHECKPOINT_EVERY, context_budget=None, metrics_only=False,
+              reuse_question_embeddings=REUSE_QUESTION_EMBEDDINGS):
+    """
+    Scores rows [start, start + limit) of `json_filename`. Rows are evaluated in chunks of `checkpoint_every`
+    and every finished row is appended to `<output>.journal.jsonl`; with `resume`, rows already in the
+    journal are skipped so only the missing ones are re-scored after a crash. The journal is deleted once
+    the final output has been written.
+    With `context_budget`, retrieved contexts are deduplicated and packed to that many tokens per row before
+    scoring; the score entries keep the original contexts and the packed ones go to `<output>.packing.json`.
+    A .jsonl `output_filename` gets each chunk's rows as soon as they are scored (see data_io.ResultWriter);
+    with `metrics_only` it holds only row, IDs and metrics.
+    With `reuse_question_embeddings`, answer_relevancy's question embeddings come from reference_store.
+    """
+    telemetry = llm_telemetry.start("02_ragas_score")
+
+    # Load processed JSON / JSONL data
+    # 默认取前 100 个元素；start/limit 通过 offset 索引只解析选中的行
+    data = load_records(json_filename, limit=limit, start=start)
 
     # 判断是否是 Baseline（如果所有 retrieved_contexts 都是 []，则为 Baseline）
-    is_baseline = all(not item["retrieved_contexts"] for item in data)
-
-    # Extract required fields for evaluation
-    questions = [item["question"] for item in data]
-    retrieved_contexts = [item["retrieved_contexts"] for item in data]  # Already an array of strings
-    generated_responses = [remove_backticks_content(item["generated_response"]) for item in data]
-    reference_answers = [item["reference_answer"] if item["reference_answer"] else "" for item in data]
+    # 分片评分时由调用方按整个文件判断后传入
+    if is_baseline is None:
+        is_baseline = all(not item["retrieved_contexts"] for item in data)
+
+    # 打包只改变送去评分的 contexts；分数条目里仍是原始的 retrieved_contexts / context_ids
+    contexts = [item["retrieved_contexts"] for item in data]
+    if context_budget and not is_baseline:
+        packed = [pack_record(item, context_budget) for item in data]
+        contexts = [record["retrieved_contexts"] for record, _ in packed]
+        stats = [record_stats for _, record_stats in packed]
+        packing = packing_report(stats, context_budget)
+        # 每行的打包结果和统计都留在报告里，分片的报告可以据此合并
+        packing["packed_contexts"] = [{"row": start + i, **id_fields(item), "retrieved_contexts": contexts[i],
+                                       **stats[i]} for i, item in enumerate(data)]
+        write_report(packing, output_filename)
 
     # 选择要计算的 Metrics
     if is_baseline:
@@ -121,52 +197,168 @@ def score_rag(json_filename, output_filename):
         print(f"Running full RAGAS evaluation for {json_filename}")
         metrics = [faithfulness, answer_relevancy, context_precision, context_recall]
 
-
-    # RAGAS requires dataset:
-    dataset = Dataset.from_dict({
-        "question": questions,
-        "generated_response": generated_responses,
-        "retrieved_contexts": retrieved_contexts,
-        "reference_answer": reference_answers
-    })
-
-    #RAGAS requires column map:
-    column_map = {
-        "question": "question",
-        "response": "generated_response",  # mapping our column "generated_response" to what RAGAS expects as "response"
-        "retrieved_contexts": "retrieved_contexts",
-        "reference": "reference_answer"
-    }
-
-    # Actual evaluation:
-    scores = evaluate(
-        dataset=dataset,
-        metrics=metrics,
-        column_map=column_map,
-    )
-
-
-    # Convert scores to a dictionary format
-    scored_data = []
-    for i in range(len(data)):
-        entry = {
-            "question": data[i]["question"],
-            "retrieved_contexts": data[i]["retrieved_contexts"],
-            "generated_response": data[i]["generated_response"],
-            "reference_answer": data[i]["reference_answer"],
-            "faithfulness": scores["faithfulness"][i] if not is_baseline else 0.0, # 如果是baseline直接输出0.0
-            "context_precision": scores["context_precision"][i] if not is_baseline else 0.0,
-            "context_recall": scores["context_recall"][i] if not is_baseline else 0.0,
-            "answer_relevancy": scores["answer_relevancy"][i],
-            "answer_correctness": 0
+    journal = ResultJournal(journal_filename(output_filename), resume=resume)
+    keys = [sample_key(start + i, item) for i, item in enumerate(data)]
+    pending = [i for i, key in enumerate(keys) if key not in journal]
+    if resume:
+        print(f"Resuming: {len(data) - len(pending)} rows already in {journal.filename}, {len(pending)} to score")
+
+    # answer_relevancy 里问题本身的 embedding 各版本相同，打开时从 reference_store 复用
+    embeddings = None
+    if reuse_question_embeddings:
+        from reference_store import question_embeddings
+        embeddings = question_embeddings([data[i] for i in pending])
+
+    writer = ResultWriter(output_filename, metrics_only=metrics_only, start=start)
+    written = 0
+
+    def write_ready():
+        # 按输入顺序写出已经评完的行（resume 时也包括 journal 里之前的结果）
+        nonlocal written
+        ready = []
+        while written < len(keys) and keys[written] in journal:
+            ready.append(journal.get(keys[written]))
+            written += 1
+        writer.write(ready)
+
+    write_ready()
+
+    for chunk_start in range(0, len(pending), checkpoint_every):
+        chunk = pending[chunk_start:chunk_start + checkpoint_every]
+        chunk_data = [data[i] for i in chunk]
+
+        # Extract required fields for evaluation
+        questions = [item["question"] for item in chunk_data]
+        retrieved_contexts = [contexts[i] for i in chunk]  # Already an array of strings
+        generated_responses = [remove_backticks_content(item["generated_response"]) for item in chunk_data]
+        reference_answers = [item["reference_answer"] if item["reference_answer"] else "" for item in chunk_data]
+
+        # RAGAS requires dataset:
+        dataset = Dataset.from_dict({
+            "question": questions,
+            "generated_response": generated_responses,
+            "retrieved_contexts": retrieved_contexts,
+            "reference_answer": reference_answers
+        })
+
+        #RAGAS requires column map:
+        column_map = {
+            "question": "question",
+            "response": "generated_response",  # mapping our column "generated_response" to what RAGAS expects as "response"
+            "retrieved_contexts": "retrieved_contexts",
+            "reference": "reference_answer"
         }
-        scored_data.append(entry)
 
-    # Save scores to JSON
-    with open(output_filename, "w", encoding="utf-8") as jsonfile:
-        json.dump(scored_data, jsonfile, indent=4, ensure_ascii=False)
+        # Actual evaluation:
+        scores = evaluate(
+            dataset=dataset,
+            metrics=metrics,
+            column_map=column_map,
+            embeddings=embeddings,
+        )
+
+        # Convert scores to a dictionary format, journaled as soon as the chunk finishes
+        for j, i in enumerate(chunk):
+            entry = {
+                **id_fields(data[i]),
+                "question": data[i]["question"],
+                **context_reference(data[i]),
+                "generated_response": data[i]["generated_response"],
+                "reference_answer": data[i]["reference_answer"],
+                "faithfulness": scores["faithfulness"][j] if not is_baseline else 0.0, # 如果是baseline直接输出0.0
+                "context_precision": scores["context_precision"][j] if not is_baseline else 0.0,
+                "context_recall": scores["context_recall"][j] if not is_baseline else 0.0,
+                "answer_relevancy": scores["answer_relevancy"][j],
+                "answer_correctness": 0
+            }
+            journal.append(keys[i], entry)
+        print(f"Checkpoint: {len(journal)}/{len(data)} rows scored")
+        write_ready()
+    writer.close()
+    # 最终结果已完整写出，journal 不再需要，也不会留在 score_data 里被当成分数文件
+    journal.remove()
 
     print(f"RAGAS scoring completed. Output saved to {output_filename}")
+    telemetry.write(output_filename)
+
+
+def shard_range(n_rows, num_shards, shard_index):
+    """ Deterministic contiguous [start, stop) of one shard, so merging is plain concatenation in input order. """
+    base, extra = divmod(n_rows, num_shards)
+    start = shard_index * base + min(shard_index, extra)
+    return start, start + base + (1 if shard_index < extra else 0)
+
+
+def shard_filename(output_filename, shard_index, num_shards):
+    stem, ext = os.path.splitext(output_filename)
+    return f"{stem}.shard{shard_index:03d}-of-{num_shards:03d}{ext}"
+
+
+def file_is_baseline(json_filename, limit=None):
+    """ Baseline = no row has retrieved contexts; stops at the first row that has some. """
+    return all(not item["retrieved_contexts"] for item in iter_records(json_filename, limit=limit))
+
+
+def score_shard(json_filename, output_filename, shard_index, num_shards, limit=None, resume=False,
+                context_budget=None, metrics_only=False, reuse_question_embeddings=REUSE_QUESTION_EMBEDDINGS):
+    """
+    Scores one shard of `json_filename` (the first `limit` rows, or all of them) into its own shard file.
+    Can run in a worker process or on another machine; merge_shards joins the results.
+    """
+    n_rows = count_records(json_filename)
+    if limit is not None:
+        n_rows = min(n_rows, limit)
+    start, stop = shard_range(n_rows, num_shards, shard_index)
+    output = shard_filename(output_filename, shard_index, num_shards)
+
+    print(f"Shard {shard_index + 1}/{num_shards}: rows {start}-{stop - 1} of {json_filename}")
+    # 完成的分片已删掉 journal，resume 时直接复用它的分片文件
+    if resume and os.path.exists(output) and not os.path.exists(journal_filename(output)):
+        print(f"Shard {shard_index + 1}/{num_shards} already scored: {output}")
+        return output
+    if stop <= start:
+        ResultWriter(output).close()
+        return output
+
+    score_rag(json_filename, output, start=start, limit=stop - start,
+              is_baseline=file_is_baseline(json_filename, limit=limit), resume=resume, context_budget=context_budget,
+              metrics_only=metrics_only, reuse_question_embeddings=reuse_question_embeddings)
+    return output
+
+
+def merge_shards(output_filename, num_shards):
+    """
+    Concatenates the shard files in order into one file laid out exactly like a single score_rag run,
+    and merges the shards' telemetry and packing reports next to it.
+    """
+    shard_files = [shard_filename(output_filename, k, num_shards) for k in range(num_shards)]
+    missing = [f for f in shard_files if not os.path.exists(f)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard score files: {missing}")
+
+    # 分片已经是最终格式（--metrics-only 的行号也是全局的），逐个分片原样接上
+    writer = ResultWriter(output_filename)
+    for filename in shard_files:
+        writer.write(iter_records(filename, resolve=False))
+    rows = writer.close()
+
+    print(f"Merged {num_shards} shards ({rows} rows). Output saved to {output_filename}")
+    # 各分片的 telemetry / packing 报告也合并成一份，和不分片时一样
+    llm_telemetry.merge([llm_telemetry.telemetry_filename(f) for f in shard_files], output_filename)
+    merge_reports([report_filename(f) for f in shard_files], output_filename)
+    return output_filename
+
+
+def score_sharded(json_filename, output_filename, num_shards, workers=None, limit=None, resume=False,
+                  context_budget=None, metrics_only=False, reuse_question_embeddings=REUSE_QUESTION_EMBEDDINGS):
+    """ Scores every shard in its own worker process, then merges them into `output_filename`. """
+    with ProcessPoolExecutor(max_workers=workers or num_shards) as executor:
+        futures = [executor.submit(score_shard, json_filename, output_filename, k, num_shards, limit, resume,
+                                   context_budget, metrics_only, reuse_question_embeddings)
+                   for k in range(num_shards)]
+        for future in futures:
+            future.result()
+    return merge_shards(output_filename, num_shards)
 
 
 if __name__ == "__main__":
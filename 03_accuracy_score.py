@@ -5,6 +5,9 @@ from ragas import evaluate
 import faulthandler
 faulthandler.enable()
 
+import llm_telemetry
+from data_io import load_records
+
 # API_KEY= "API"
 
 os.environ["http_proxy"] = "http://localhost:7890"
@@ -17,9 +20,10 @@ def accuracy_score_byLLM():
     pass
 
 def score_rag(json_filename, output_filename):
-    # Load processed JSON data
-    with open(json_filename, "r", encoding="utf-8") as jsonfile:
-        data = json.load(jsonfile)
+    telemetry = llm_telemetry.start("03_accuracy_score")
+
+    # Load processed JSON / JSONL data
+    data = load_records(json_filename)
 
     # 判断是否是 Baseline（如果所有 retrieved_contexts 都是 []，则为 Baseline）
     is_baseline = all(not item["retrieved_contexts"] for item in data)
@@ -84,6 +88,7 @@ def score_rag(json_filename, output_filename):
         json.dump(scored_data, jsonfile, indent=4, ensure_ascii=False)
 
     print(f"RAGAS scoring completed. Output saved to {output_filename}")
+    telemetry.write(output_filename)
 
 
 if __name__ == "__main__":
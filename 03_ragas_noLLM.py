@@ -1,28 +1,73 @@
-import json
 import asyncio
-from ragas import SingleTurnSample
-from ragas.metrics import (
-    NonLLMStringSimilarity,
-    BleuScore,
-    RougeScore,
-)
-
-# Input JSON file from previous step
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from context_store import context_reference
+from data_io import ResultWriter, id_fields, iter_records, load_records
+from record_index import count_records
+import code_similarity
+import reference_store
+import sparse_similarity
+import text_metrics
+
+# Input JSON file from previous step (.json or streamed .jsonl)
 json_filename = "processed_data.json"
 # Output JSON file
 output_filename = "ragas_noLLM_scores.json"
 
-# Load processed JSON data
-with open(json_filename, "r", encoding="utf-8") as jsonfile:
-    data = json.load(jsonfile)
+# "batch": text_metrics scores the whole file at once (same values as ragas, much faster);
+# "ragas": the original per-sample ragas metrics
+ENGINE = os.getenv("NONLLM_ENGINE", "batch")
+# Pool mode: 1 = score in this process, N > 1 = N worker processes, 0 = one per CPU core
+WORKERS = int(os.getenv("NONLLM_WORKERS", "1"))
+# Rows per task sent to a worker
+CHUNK_SIZE = int(os.getenv("NONLLM_CHUNK_SIZE", "256"))
+# Batch engine: load the reference answers' tokens / n-gram counts from reference_store (0 = always recompute)
+USE_REFERENCE_STORE = os.getenv("NONLLM_REFERENCE_STORE", "1") != "0"
+# Vocabulary from `answer_eval.py sparse-fit`; when set, BM25 / TF-IDF similarities are added to every row
+SPARSE_VOCAB = os.getenv("NONLLM_SPARSE_VOCAB") or None
+# 1 = add code_similarity (structural YAML / command overlap, see code_similarity) to every row
+CODE_METRIC = os.getenv("NONLLM_CODE_SIMILARITY", "0") == "1"
+# 1 = write only row / IDs / metric values, without the copied question, contexts and answers
+METRICS_ONLY = os.getenv("NONLLM_METRICS_ONLY", "0") == "1"
+
+_ragas_metrics = None
+
+
+def get_ragas_metrics():
+    """ ragas is imported only when the per-sample engine is used. """
+    global _ragas_metrics
+    if _ragas_metrics is None:
+        from ragas.metrics import (
+            NonLLMStringSimilarity,
+            BleuScore,
+            RougeScore,
+        )
+        _ragas_metrics = (NonLLMStringSimilarity(), BleuScore(), RougeScore())
+    return _ragas_metrics
+
+
+def scored_entry(item, string_similarity, bleu_score, rouge_score):
+    return {
+        **id_fields(item),
+        "question": item["question"],
+        **context_reference(item),
+        "generated_response": item["generated_response"],
+        "reference_answer": item.get("reference_answer", ""),
+        "nonllm_string_similarity": string_similarity,
+        "bleu_score": bleu_score,
+        "rouge_score": rouge_score,
+    }
 
-# Initialize metrics
-string_similarity_metric = NonLLMStringSimilarity()
-bleu_metric = BleuScore()
-rouge_metric = RougeScore()
 
 async def evaluate_sample(item):
     """ Runs non-LLM text similarity metrics for a single sample. """
+    from ragas import SingleTurnSample
+
+    string_similarity_metric, bleu_metric, rouge_metric = get_ragas_metrics()
     response_sample = SingleTurnSample(
         response=item["generated_response"],
         reference=item["reference_answer"]
@@ -39,28 +84,145 @@ async def evaluate_sample(item):
         rouge_metric.single_turn_ascore(response_sample),
     )
 
-    return {
-        "question": item["question"],
-        "retrieved_contexts": item["retrieved_contexts"],
-        "generated_response": item["generated_response"],
-        "reference_answer": item.get("reference_answer", ""),
-        "nonllm_string_similarity": string_similarity,
-        "bleu_score": bleu_score,
-        "rouge_score": rouge_score,
-    }
+    return scored_entry(item, string_similarity, bleu_score, rouge_score)
+
+
+def add_sparse_scores(data, scored_data, sparse_vocab, reference_tokens=None):
+    """ Adds sparse_reference_similarity / sparse_context_similarity (see sparse_similarity) to each entry. """
+    scores = sparse_similarity.score_records(data, sparse_vocab, reference_tokens)
+    for row, entry in enumerate(scored_data):
+        for name, values in scores.items():
+            entry[name] = float(values[row])
+    return scored_data
+
+
+def add_code_scores(data, scored_data, reference_features=None):
+    """ Adds code_similarity (None where the reference answer has no code) to each entry. """
+    for entry, score in zip(scored_data, code_similarity.score_records(data, reference_features)):
+        entry["code_similarity"] = score
+    return scored_data
+
+
+def add_extra_scores(data, scored_data, sparse_vocab=None, code_metric=False, artifacts=None):
+    """ The optional metrics; reference-side tokens / code features come from `artifacts` when given. """
+    if sparse_vocab:
+        # 参考答案的词干 token 已经在 reference_store 里，直接复用
+        reference_tokens = [artifact["rouge_tokens"] for artifact in artifacts] if artifacts else None
+        add_sparse_scores(data, scored_data, sparse_vocab, reference_tokens)
+    if code_metric:
+        reference_features = [artifact["code_features"] for artifact in artifacts] if artifacts else None
+        add_code_scores(data, scored_data, reference_features)
+    return scored_data
+
+
+def evaluate_batch(data, sparse_vocab=None, code_metric=False):
+    """ Scores all samples at once with text_metrics (corpus tokenized once, array-based counting). """
+    artifacts = reference_store.reference_artifacts(data) if USE_REFERENCE_STORE else None
+    scores = text_metrics.score_corpus(
+        [item.get("reference_answer", "") for item in data],
+        [item["generated_response"] for item in data],
+        artifacts=artifacts,
+    )
+    scored_data = [
+        scored_entry(item, float(string_similarity), float(bleu_score), float(rouge_score))
+        for item, string_similarity, bleu_score, rouge_score in zip(
+            data, scores["nonllm_string_similarity"], scores["bleu_score"], scores["rouge_score"]
+        )
+    ]
+    return add_extra_scores(data, scored_data, sparse_vocab, code_metric, artifacts)
 
-async def evaluate_samples():
-    """ Runs all non-LLM text similarity evaluations asynchronously. """
-    tasks = [evaluate_sample(item) for item in data]
-    scored_data = await asyncio.gather(*tasks)
 
-    # Save the scores to a JSON file
-    with open(output_filename, "w", encoding="utf-8") as jsonfile:
-        json.dump(scored_data, jsonfile, indent=4, ensure_ascii=False)
+async def evaluate_chunk(chunk):
+    return await asyncio.gather(*[evaluate_sample(item) for item in chunk])
+
+
+def score_chunk(chunk, engine=ENGINE, sparse_vocab=SPARSE_VOCAB, code_metric=CODE_METRIC):
+    """ Scores one chunk of samples; runs inside a worker process in pool mode. """
+    if engine == "batch":
+        return evaluate_batch(chunk, sparse_vocab, code_metric)
+    loop = asyncio.new_event_loop()
+    try:
+        scored_data = loop.run_until_complete(evaluate_chunk(chunk))
+    finally:
+        loop.close()
+    return add_extra_scores(chunk, scored_data, sparse_vocab, code_metric)
+
+
+def iter_chunks(records, chunk_size):
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        yield chunk
+
+
+def iter_scored_parallel(records, engine=ENGINE, workers=0, chunk_size=CHUNK_SIZE, total=None,
+                         sparse_vocab=SPARSE_VOCAB, code_metric=CODE_METRIC):
+    """
+    Scores `records` in chunks of `chunk_size` over `workers` processes (0 = all cores) and yields the
+    scored chunks in input order, printing a progress counter as chunks complete.
+    """
+    workers = workers if workers > 0 else os.cpu_count()
+    chunks = iter_chunks(records, chunk_size)
+    done = 0
+    last_report = 0.0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 最多 2 * workers 个块在途：输入按需读取，内存不随文件大小增长，worker 也不会空等
+        pending = deque(executor.submit(score_chunk, chunk, engine, sparse_vocab, code_metric)
+                        for chunk in islice(chunks, 2 * workers))
+        while pending:
+            scored = pending.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(score_chunk, chunk, engine, sparse_vocab, code_metric))
+            done += len(scored)
+            if time.monotonic() - last_report >= 1 or not pending:
+                last_report = time.monotonic()
+                print(f"\r03 scored {done}/{total if total is not None else '?'} rows", end="", flush=True)
+            yield scored
+    print()
+
+
+async def evaluate_samples(json_filename=json_filename, output_filename=output_filename, start=0, limit=None,
+                           engine=ENGINE, workers=WORKERS, chunk_size=CHUNK_SIZE, sparse_vocab=SPARSE_VOCAB,
+                           code_metric=CODE_METRIC, metrics_only=METRICS_ONLY):
+    """
+    Runs all non-LLM text similarity evaluations (batch engine, or ragas asynchronously; optionally in a process pool).
+    A .jsonl `output_filename` is written chunk by chunk as scoring goes (see data_io.ResultWriter).
+    """
+    with ResultWriter(output_filename, metrics_only=metrics_only, start=start) as writer:
+        if workers != 1:
+            total = max(count_records(json_filename) - start, 0)
+            if limit is not None:
+                total = min(total, limit)
+            records = iter_records(json_filename, limit=limit, start=start)
+            for scored in iter_scored_parallel(records, engine, workers, chunk_size, total, sparse_vocab, code_metric):
+                writer.write(scored)
+        else:
+            # JSONL 输出逐块读取、评分、写出，内存不随文件大小增长；旧的 .json 输出整个文件一次算完
+            if writer.streaming:
+                chunks = iter_chunks(iter_records(json_filename, limit=limit, start=start), chunk_size)
+            else:
+                chunks = [load_records(json_filename, limit=limit, start=start)]
+
+            for data in chunks:
+                if engine == "batch":
+                    scored_data = evaluate_batch(data, sparse_vocab, code_metric)
+                else:
+                    tasks = [evaluate_sample(item) for item in data]
+                    scored_data = await asyncio.gather(*tasks)
+                    add_extra_scores(data, scored_data, sparse_vocab, code_metric)
+                writer.write(scored_data)
 
     print(f"Non-LLM text similarity evaluation completed. Output saved to {output_filename}")
 
 
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-loop.run_until_complete(evaluate_samples())
+def run(json_filename=json_filename, output_filename=output_filename, start=0, limit=None, engine=ENGINE,
+        workers=WORKERS, chunk_size=CHUNK_SIZE, sparse_vocab=SPARSE_VOCAB, code_metric=CODE_METRIC,
+        metrics_only=METRICS_ONLY):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(evaluate_samples(json_filename, output_filename, start, limit, engine, workers, chunk_size,
+                                             sparse_vocab, code_metric, metrics_only))
+
+
+if __name__ == "__main__":
+    run()
@@ -1,7 +1,8 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import os, json, re
 
+from data_io import is_score_file, load_columns
+
 def get_file_names(directory):
     # 获取目录下的所有文件和文件夹
     all_items = os.listdir(directory)
@@ -31,6 +32,7 @@ def cal_gpt_indicator():
 
 # 该函数用于统计某一 RAG 版本各个 Metric 在 0-1 不同区间的分布情况
 def plt_data(arrays, filename):
+    import matplotlib.pyplot as plt  # 只在画图时才加载 matplotlib
 
     # 提取 `test_n` 作为标识
     base_name = os.path.basename(filename)  # 获取文件名部分（去掉路径）
@@ -82,32 +84,20 @@ def plt_data(arrays, filename):
 
 
 # 该函数用于统计某个 RAG 版本的 Metric 分数
-def cal_rag_score(filename):
+def cal_rag_score(filename, start=0, limit=100, plot=True):
 
     print("filename is :", filename)
     # 五个 Metric
-    faithfulness = list()
-    answer_relevancy = list()
-    context_precision = list()
-    context_recall = list()
+    # 只读取需要的 metric 列；有列式缓存时直接 mmap float 数组，不碰长文本
+    # start/limit 选择行范围（默认前 100 行），通过 offset 索引跳过其余行
+    columns = load_columns(filename, ["faithfulness", "answer_relevancy", "context_precision", "context_recall"],
+                           limit=limit, start=start)
+    faithfulness = columns["faithfulness"]
+    answer_relevancy = columns["answer_relevancy"]
+    context_precision = columns["context_precision"]
+    context_recall = columns["context_recall"]
     # accuracy = list()
 
-    with open(filename, "r", encoding='utf-8') as f:
-        eval_results = json.load(f)
-
-    eval_results = eval_results[:100]
-
-    for result in eval_results:
-        try:
-            faithfulness.append(result["faithfulness"])
-            answer_relevancy.append(result["answer_relevancy"])
-            context_precision.append(result["context_precision"])
-            context_recall.append(result["context_recall"])
-            # accuracy.append(result["answer_correctness"])
-        except:
-            # accuracy.append(result["answer_correctness"])
-            pass
-
     # if "5" in filename:
     #     faithfulness = np.array([x if x is not None else np.nan for x in faithfulness])
     #     faithfulness = np.array([1 if x > 0.2 else 0 for x in faithfulness])
@@ -130,20 +120,26 @@ def cal_rag_score(filename):
     # accuracy = np.array([x if x is not None else np.nan for x in accuracy])
     # accuracy_mean = np.nanmean(accuracy)
     # accuracy_var = np.var(accuracy)
-    plt_data([faithfulness, answer_relevancy, context_precision, context_recall], filename)
+    if plot:
+        plt_data([faithfulness, answer_relevancy, context_precision, context_recall], filename)
     
     return [faithfulness_mean, answer_relevancy_mean, context_precision_mean, context_recall_mean]
 
-def plt_compare_scores():
-    directory_path = './score_data'
-    file_names = get_file_names(directory_path)
-
+def plt_compare_scores(directory_path='./score_data', plot=True):
+    # 只读取分数文件，跳过 .idx 索引等旁路文件
+    file_names = [file for file in get_file_names(directory_path) if is_score_file(file)]
 
     # scores 记录各个版本的 五个指标 的数据
     scores = list()
     for file in file_names:
-        scores.append(cal_rag_score(directory_path + "/" + file))
+        scores.append(cal_rag_score(directory_path + "/" + file, plot=plot))
 
+    # 不画图时只输出各版本的均值（纯 NumPy，不加载 matplotlib）
+    if not plot:
+        summary = dict(zip(file_names, scores))
+        for file, values in summary.items():
+            print(file, [round(float(v), 4) for v in values])
+        return summary
 
     # 提取所有 test 版本号
     test_numbers = []
@@ -165,6 +161,8 @@ def plt_compare_scores():
     # 打印出这些数据，以方便利用
     print(scores)
 
+    import matplotlib.pyplot as plt
+
     scores = np.array(scores)
 
     # Metric 名称
@@ -210,5 +208,6 @@ def plt_compare_scores():
 
     plt.show()
 
-plt_compare_scores()
-# cal_gpt_indicator()
\ No newline at end of file
+if __name__ == "__main__":
+    plt_compare_scores()
+    # cal_gpt_indicator()
@@ -0,0 +1,218 @@
+"""
+answer-eval: one entry point for the numbered pipeline scripts.
+
+    python answer_eval.py process     # 01_data_process
+    python answer_eval.py pack        # context_packing: dedup + token-budget retrieved contexts
+    python answer_eval.py score       # 02_ragas_score (ragas / datasets), --shards N for parallel shards
+    python answer_eval.py merge-shards
+    python answer_eval.py merge-delta # previous version's scores + re-scored delta rows (01 --delta)
+    python answer_eval.py sparse-fit  # sparse_similarity: BM25 / TF-IDF vocabulary for score-nollm --sparse-vocab
+    python answer_eval.py score-nollm # 03_ragas_noLLM (text_metrics batch engine, --engine ragas)
+    python answer_eval.py code-agreement  # code_similarity vs the archive keypoint grader's Y / N
+    python answer_eval.py report      # 04_outcome (numpy, matplotlib only when plotting)
+
+Each stage module is imported only when its subcommand runs, so `--help`, `--dry-run`
+and `report --no-plot` never pay the ragas / datasets / matplotlib import cost.
+"""
+import argparse
+import importlib
+import sys
+
+
+def _stage(module_name):
+    """ Lazily imports a numbered pipeline script (e.g. "02_ragas_score"). """
+    return importlib.import_module(module_name)
+
+
+def cmd_process(args):
+    if args.dry_run:
+        print(f"process: would convert {args.files or 'every CSV in ' + args.directory} "
+              f"(format={args.format}, columnar={args.columnar}, intern_contexts={args.intern_contexts})")
+        return
+
+    stage = _stage("01_data_process")
+    if args.delta:
+        stage.data_delta(*args.delta, directory=args.directory)
+    elif args.cache_scores:
+        stage.cache_score_files(args.score_directory)
+    elif args.files:
+        for file in args.files:
+            stage.data_process(file, output_format=args.format, directory=args.directory,
+                               columnar=args.columnar, intern_contexts=args.intern_contexts)
+    else:
+        stage.batch_process(args.directory, workers=args.workers, output_format=args.format,
+                            columnar=args.columnar, intern_contexts=args.intern_contexts)
+
+
+def _dry_run_summary(args):
+    from data_io import load_records
+
+    data = load_records(args.input, limit=args.limit, start=args.start)
+    is_baseline = all(not item.get("retrieved_contexts") and not item.get("context_ids") for item in data)
+    print(f"{args.command}: {len(data)} rows of {args.input} (start={args.start}), "
+          f"baseline={is_baseline}, output={args.output}")
+
+
+def cmd_score(args):
+    if args.dry_run:
+        return _dry_run_summary(args)
+    stage = _stage("02_ragas_score")
+    if args.shard:
+        # 只跑一个分片（例如在另一台机器上），之后用 merge-shards 合并
+        shard_index, num_shards = (int(x) for x in args.shard.split("/"))
+        stage.score_shard(args.input, args.output, shard_index, num_shards, limit=args.limit, resume=args.resume,
+                          context_budget=args.context_budget, metrics_only=args.metrics_only,
+                          reuse_question_embeddings=args.reuse_question_embeddings)
+    elif args.shards:
+        stage.score_sharded(args.input, args.output, args.shards, workers=args.workers, limit=args.limit,
+                            resume=args.resume, context_budget=args.context_budget, metrics_only=args.metrics_only,
+                            reuse_question_embeddings=args.reuse_question_embeddings)
+    else:
+        stage.score_rag(args.input, args.output, start=args.start, limit=args.limit, resume=args.resume,
+                        context_budget=args.context_budget, metrics_only=args.metrics_only,
+                        reuse_question_embeddings=args.reuse_question_embeddings)
+
+
+def cmd_pack(args):
+    from context_packing import pack_file
+
+    pack_file(args.input, args.output, budget=args.budget, limit=args.limit)
+
+
+def cmd_merge_shards(args):
+    _stage("02_ragas_score").merge_shards(args.output, args.shards)
+
+
+def cmd_merge_delta(args):
+    _stage("02_ragas_score").merge_delta_scores(args.previous_scores, args.delta_scores, args.processed, args.output,
+                                                limit=args.limit)
+
+
+def cmd_score_nollm(args):
+    if args.dry_run:
+        return _dry_run_summary(args)
+    _stage("03_ragas_noLLM").run(args.input, args.output, start=args.start, limit=args.limit, engine=args.engine,
+                                 workers=args.workers, chunk_size=args.chunk_size, sparse_vocab=args.sparse_vocab,
+                                 code_metric=args.code_similarity, metrics_only=args.metrics_only)
+
+
+def cmd_sparse_fit(args):
+    from sparse_similarity import fit_files
+
+    fit_files(args.inputs, args.output, weighting=args.weighting, min_df=args.min_df)
+
+
+def cmd_code_agreement(args):
+    from code_similarity import compare_with_grader
+
+    compare_with_grader(args.input, args.results, args.output, threshold=args.threshold)
+
+
+def cmd_report(args):
+    _stage("04_outcome").plt_compare_scores(args.directory, plot=not args.no_plot)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="answer-eval", description="RAG answer evaluation pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    process = subparsers.add_parser("process", help="convert RAG result CSVs into processed data (01)")
+    process.add_argument("files", nargs="*", help="CSV files in --directory; default: batch-convert all of them")
+    process.add_argument("--directory", default="./dev_data")
+    process.add_argument("--format", choices=["json", "jsonl"], default="jsonl")
+    process.add_argument("--workers", type=int, default=None)
+    process.add_argument("--columnar", action="store_true", help="also emit the memory-mapped columnar cache")
+    process.add_argument("--intern-contexts", action="store_true", help="reference contexts by gpt_Context_IDs")
+    process.add_argument("--delta", nargs=2, metavar=("CSV", "PREVIOUS_CSV"),
+                         help="write only the rows of CSV that changed since PREVIOUS_CSV")
+    process.add_argument("--cache-scores", action="store_true", help="build columnar caches for --score-directory")
+    process.add_argument("--score-directory", default="./score_data")
+    process.add_argument("--dry-run", action="store_true")
+    process.set_defaults(func=cmd_process)
+
+    for name, func, default_output, help_text in [
+        ("score", cmd_score, "ragas_scores.json", "RAGAS LLM metrics (02)"),
+        ("score-nollm", cmd_score_nollm, "ragas_noLLM_scores.json", "BLEU / ROUGE / string similarity (03)"),
+    ]:
+        score = subparsers.add_parser(name, help=help_text)
+        score.add_argument("input", help="processed .json / .jsonl file")
+        score.add_argument("output", nargs="?", default=default_output)
+        score.add_argument("--start", type=int, default=0)
+        score.add_argument("--limit", type=int, default=100 if name == "score" else None)
+        score.add_argument("--dry-run", action="store_true", help="show what would be scored without loading ragas")
+        score.add_argument("--metrics-only", action="store_true",
+                           help="write only row, IDs and metric values (no question / context / answer texts)")
+        score.set_defaults(func=func)
+        if name == "score":
+            score.add_argument("--shards", type=int, help="split into N shards, score them in worker processes, merge")
+            score.add_argument("--workers", type=int, default=None)
+            score.add_argument("--shard", metavar="K/N", help="score only shard K (0-based) of N")
+            score.add_argument("--resume", action="store_true",
+                               help="skip rows already in <output>.journal.jsonl from an interrupted run")
+            score.add_argument("--context-budget", type=int, default=None, metavar="TOKENS",
+                               help="dedup retrieved contexts and pack them to TOKENS per row before scoring")
+            score.add_argument("--reuse-question-embeddings", action="store_true",
+                               help="take answer_relevancy's question embeddings from reference_store.sqlite")
+        else:
+            score.add_argument("--engine", choices=["batch", "ragas"], default="batch",
+                               help="batch: score the whole file at once with text_metrics; ragas: per sample")
+            score.add_argument("--workers", type=int, default=1,
+                               help="score chunks in N worker processes (0 = one per CPU core)")
+            score.add_argument("--chunk-size", type=int, default=256, help="rows per worker task")
+            score.add_argument("--sparse-vocab", default=None, metavar="JSON",
+                               help="add BM25 / TF-IDF response-reference and response-context similarities "
+                                    "(vocabulary from sparse-fit)")
+            score.add_argument("--code-similarity", action="store_true",
+                               help="add code_similarity: structural overlap of the YAML / commands in the answers")
+
+    pack = subparsers.add_parser("pack", help="dedup and token-budget retrieved contexts into a new processed file")
+    pack.add_argument("input", help="processed .json / .jsonl file")
+    pack.add_argument("output", help="packed .jsonl file to write")
+    pack.add_argument("--budget", type=int, default=1024, help="context tokens per row")
+    pack.add_argument("--limit", type=int, default=None)
+    pack.set_defaults(func=cmd_pack)
+
+    sparse_fit = subparsers.add_parser("sparse-fit", help="fit the offline sparse-similarity vocabulary")
+    sparse_fit.add_argument("inputs", nargs="+", help="processed .json / .jsonl files (questions, references, contexts)")
+    sparse_fit.add_argument("--output", default="sparse_vocab.json")
+    sparse_fit.add_argument("--weighting", choices=["bm25", "tfidf"], default="bm25")
+    sparse_fit.add_argument("--min-df", type=int, default=1, help="drop terms found in fewer documents")
+    sparse_fit.set_defaults(func=cmd_sparse_fit)
+
+    code = subparsers.add_parser("code-agreement",
+                                 help="score code similarity and compare it with LLM_keypoint_results.csv")
+    code.add_argument("input", help="archive pipeline input CSV (Answer ID, Answer Body, gpt_Generated_Response)")
+    code.add_argument("results", nargs="?", default="archive/LLM_keypoint_results.csv")
+    code.add_argument("--output", default="code_similarity_results.csv")
+    code.add_argument("--threshold", type=float, default=None,
+                      help="Y when code_similarity >= this (default: the threshold that agrees best)")
+    code.set_defaults(func=cmd_code_agreement)
+
+    delta = subparsers.add_parser("merge-delta", help="combine the previous version's scores with re-scored delta rows")
+    delta.add_argument("previous_scores", help="score file of the previous RAG version")
+    delta.add_argument("delta_scores", help="score file of the delta rows (score <name>delta_data.jsonl)")
+    delta.add_argument("processed", help="processed file of the new version; sets the row order")
+    delta.add_argument("output")
+    delta.add_argument("--limit", type=int, default=None, help="only the first N rows of the processed file")
+    delta.set_defaults(func=cmd_merge_delta)
+
+    merge = subparsers.add_parser("merge-shards", help="merge per-shard score files into one (02)")
+    merge.add_argument("output", help="final score file; shards are read from <output>.shardKKK-of-NNN.json")
+    merge.add_argument("--shards", type=int, required=True)
+    merge.set_defaults(func=cmd_merge_shards)
+
+    report = subparsers.add_parser("report", help="aggregate and plot score files (04)")
+    report.add_argument("--directory", default="./score_data")
+    report.add_argument("--no-plot", action="store_true", help="print metric means only, without matplotlib")
+    report.set_defaults(func=cmd_report)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
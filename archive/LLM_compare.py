@@ -1,12 +1,24 @@
 import os
+import sys
+import asyncio
 import openai
 import pandas as pd
 
+# Entry script: the repository root (llm_telemetry, result_journal) goes on sys.path here, once;
+# library modules such as llm_client just import from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from llm_cache import get_cache
+from llm_client import get_client
+import llm_telemetry
+
 # Load API key from environment variable
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Function to get similarity reasoning from GPT-4 Turbo
-def evaluate_generated_answer(text1, text2):
+async def evaluate_generated_answer(text1, text2):
     """Evaluates the model-generated answer (Text 2) against the correct StackOverflow answer (Text 1),
     providing an accuracy score and reasoning for mistakes."""
     
@@ -41,37 +53,52 @@ def evaluate_generated_answer(text1, text2):
     </evaluation>
     """
 
-    response = openai.chat.completions.create(
+    # Shared client: bounded concurrency, RPM/TPM limits, backoff with jitter,
+    # identical text pairs are answered from the on-disk cache (llm_cache.sqlite)
+    return await get_client().chat(
         model="gpt-4-turbo",  # Use "gpt-3.5-turbo" if needed
         messages=[{"role": "user", "content": prompt}]
     )
-    return response.choices[0].message.content
 
 
-# Load CSV file
-input_csv = "input_data.csv"  # Replace with your actual file
-df = pd.read_csv(input_csv)
+async def compare_rows(df):
+    """ Grades every row concurrently; the shared client keeps in-flight requests and rate within limits. """
+    async def compare_row(row):
+        text1 = str(row["StackOverflow Answer"]).strip()  # Convert to string and remove whitespace
+        text2 = str(row["Previous RAG Answer"]).strip()
+
+        if not text1 or not text2:
+            explanation = "Similarity Score: N/A\nReasoning: Missing Data"
+        else:
+            try:
+                explanation = await evaluate_generated_answer(text1, text2)
+            except openai.OpenAIError as e:
+                print(f"OpenAI API Error: {e}")
+                explanation = "API Error"
+
+        return {"ID": row["ID"], "LLM Method Result": explanation}
+
+    return await asyncio.gather(*[compare_row(row) for _, row in df.iterrows()])
 
-# Ensure required columns exist
-if "StackOverflow Answer" not in df.columns or "Previous RAG Answer" not in df.columns:
-    raise ValueError("CSV must contain 'StackOverflow Answer' and 'Previous RAG Answer' columns")
 
-# Process each row
-results = []
-for index, row in df.iterrows():
-    text1 = str(row["StackOverflow Answer"]).strip()  # Convert to string and remove whitespace
-    text2 = str(row["Previous RAG Answer"]).strip()
+if __name__ == "__main__":
+    # Load CSV file
+    input_csv = "input_data.csv"  # Replace with your actual file
+    df = pd.read_csv(input_csv)
 
-    if not text1 or not text2:
-        explanation = "Similarity Score: N/A\nReasoning: Missing Data"
-    else:
-        explanation = evaluate_generated_answer(text1, text2)
+    # Ensure required columns exist
+    if "StackOverflow Answer" not in df.columns or "Previous RAG Answer" not in df.columns:
+        raise ValueError("CSV must contain 'StackOverflow Answer' and 'Previous RAG Answer' columns")
 
-    results.append({"ID": row["ID"], "LLM Method Result": explanation})
+    # Process each row
+    telemetry = llm_telemetry.start("LLM_compare")
+    results = asyncio.run(compare_rows(df))
 
-# Save results to CSV
-output_csv = "LLM_comparison_results.csv"
-output_df = pd.DataFrame(results)
-output_df.to_csv(output_csv, index=False)
+    # Save results to CSV
+    output_csv = "LLM_comparison_results.csv"
+    output_df = pd.DataFrame(results)
+    output_df.to_csv(output_csv, index=False)
 
-print(f"Comparison completed. Results saved to {output_csv}")
+    print(f"Comparison completed. Results saved to {output_csv}")
+    print(get_cache().stats())
+    telemetry.write(output_csv)
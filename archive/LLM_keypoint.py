@@ -1,10 +1,23 @@
 import os
+import sys
+import argparse
 import openai
 import pandas as pd
 import asyncio
-import time
 from bs4 import BeautifulSoup
 
+# Entry script: the repository root (llm_telemetry, result_journal) goes on sys.path here, once;
+# library modules such as llm_client just import from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from llm_cache import get_cache
+from llm_client import get_client
+from keypoint_store import extract_with_store, prompt_version, text_hash
+import llm_telemetry
+from result_journal import ResultJournal, journal_filename
+
 # os.environ["http_proxy"] = "http://localhost:7890"
 # os.environ["https_proxy"] = "http://localhost:7890"
 
@@ -14,11 +27,10 @@ input_csv = "input_data.csv"
 # save keypoints in seperated files
 keypoints_stack_csv = "keypoints_stack.csv"
 keypoints_RAG_csv = "keypoints_RAG.csv"
+results_csv = "LLM_keypoint_results.csv"
 
-#async to imporve speed:
-async def extract_key_points_from_text(text):
-
-    prompt = f"""
+def build_keypoint_prompt(text):
+    return f"""
     You are an expert summarizer and familiar with Cloud-native. You will recieve a 'verified correct answer' (Text 1)which is a solution for some problems.
     The "Text 1" contains a description of solution and specific codes snippets. The description is usually a normal sentence, while the code consists of a series of words. Please try to distinguish them.
     Text 1 may provide multiple solutions. For each solution, you need to extract and summarize a key point. Each key point must include the most important and concise overview, and be accompanied by relevant code snippets at the end.
@@ -74,60 +86,53 @@ async def extract_key_points_from_text(text):
     {text}
     """
 
-    for attempt in range(3):  # Retry up to 3 times
-        try:
-            response = await asyncio.to_thread(
-                openai.chat.completions.create,  # Runs the blocking function in a thread
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0
-            )
-            return response.choices[0].message.content.strip()  # Successful response
-        except openai.RateLimitError:
-            print(f"Rate limit error, retrying ({attempt+1}/3)...")
-            time.sleep(2 ** attempt)  # Uses time.sleep() instead of async sleep
-        except openai.OpenAIError as e:
-            print(f"OpenAI API Error: {e}")
-            return "API Error"
-
-    return "API Error: Max retries exceeded."
-
-
-# Check if we can reuse keypoints_stack.csv
-def can_use_existing_keypoints(margin=10):
-    if os.path.exists(keypoints_stack_csv):
-        df_input = pd.read_csv(input_csv)
-        df_stack = pd.read_csv(keypoints_stack_csv)
-
-        # Check if the row count is within margin
-        return abs(len(df_input) - len(df_stack)) <= margin
-    return False
+
+#async to imporve speed:
+# Stored key points are only reused for the same model and prompt template
+KEYPOINT_PROMPT_VERSION = prompt_version(build_keypoint_prompt, "gpt-4o-mini")
+
+
+async def extract_key_points_from_text(text):
+    prompt = build_keypoint_prompt(text)
+
+    try:
+        # Shared client: bounded concurrency, RPM/TPM limits, non-blocking backoff with jitter
+        content = await get_client().chat(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0
+        )
+        return content.strip()  # Successful response
+    except openai.RateLimitError:
+        print("Rate limit error, max retries exceeded.")
+        return "API Error: Max retries exceeded."
+    except openai.OpenAIError as e:
+        print(f"OpenAI API Error: {e}")
+        return "API Error"
+
 
 # Save key points extracted from CSV
 async def save_keypoints():
     df = pd.read_csv(input_csv)
-    
-    key_points_list_1 = []
-    key_points_list_2 = []
-
-    if can_use_existing_keypoints(margin=10):
-        print("Reusing existing keypoints_stack.csv")
-        df_stack = pd.read_csv(keypoints_stack_csv)
-        key_points_list_1 = df_stack["Key Points"].tolist()
-    else:
-        print("Extracting new key points for stack answers...")
-        key_points_list_1 = await asyncio.gather(*[extract_key_points_from_text(str(row["Answer Body"]).strip()) for _, row in df.iterrows()])
-        pd.DataFrame({"Key Points": key_points_list_1}).to_csv(keypoints_stack_csv, index=False)
-    
-    print("Extracting new key points for RAG answers...")
-    key_points_list_2 = await asyncio.gather(*[extract_key_points_from_text(str(row["gpt_Generated_Response"]).strip()) for _, row in df.iterrows()])
-    
+
+    # 按 Answer ID + 文本哈希 + prompt 版本查库，只抽取新增或改动过的回答
+    print("Extracting key points for stack answers...")
+    key_points_list_1 = await extract_with_store(
+        df["Answer ID"], [str(text).strip() for text in df["Answer Body"]],
+        extract_key_points_from_text, KEYPOINT_PROMPT_VERSION, "Stack answers")
+    pd.DataFrame({"Key Points": key_points_list_1}).to_csv(keypoints_stack_csv, index=False)
+
+    print("Extracting key points for RAG answers...")
+    key_points_list_2 = await extract_with_store(
+        df["Answer ID"], [str(text).strip() for text in df["gpt_Generated_Response"]],
+        extract_key_points_from_text, KEYPOINT_PROMPT_VERSION, "RAG answers")
+
     pd.DataFrame({"Key Points": key_points_list_2}).to_csv(keypoints_RAG_csv, index=False)
     print("Key point extraction completed.")
 
 
-async def evaluate_generated_answer(text1, text2):
-    prompt = f"""
+def build_evaluation_prompt(text1, text2):
+    return f"""
     <evaluation>
         <instructions>
             You are an expert in Cloud-native. You are evaluating **an alternate answer (Text 2)** against a **verified correct answer** (Text 1).
@@ -155,74 +160,111 @@ async def evaluate_generated_answer(text1, text2):
     </evaluation>
     """
 
-    for attempt in range(3):  # Retry up to 3 times
-        try:
-            response = await asyncio.to_thread(
-                openai.chat.completions.create,  # Runs the blocking function in a thread
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0
-            )
-            return response.choices[0].message.content.strip()  # Successfully returns async result
-        except openai.RateLimitError:
-            print(f"⚠️ Rate limit error, retrying ({attempt+1}/3)...")
-            await asyncio.sleep(2 ** attempt)  # Uses proper async wait
-        except openai.OpenAIError as e:
-            print(f"❌ OpenAI API Error: {e}")
-            return "API Error"
-
-    return "API Error: Max retries exceeded."
+
+async def evaluate_generated_answer(text1, text2):
+    prompt = build_evaluation_prompt(text1, text2)
+
+    try:
+        # Shared client: bounded concurrency, RPM/TPM limits, non-blocking backoff with jitter
+        content = await get_client().chat(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0
+        )
+        return content.strip()  # Successfully returns async result
+    except openai.RateLimitError:
+        print("⚠️ Rate limit error, max retries exceeded.")
+        return "API Error: Max retries exceeded."
+    except openai.OpenAIError as e:
+        print(f"❌ OpenAI API Error: {e}")
+        return "API Error"
+
+
+def result_row(df, df_stack, df_RAG, index, explanation):
+    """ One row of LLM_keypoint_results.csv, Score is Y when <accuracy_score> >= 60. """
+    explanation_soup = BeautifulSoup(explanation, 'html.parser')
+    try:
+        accuracy_score = int(explanation_soup.find("accuracy_score").contents[0])
+        final_score = "Y" if accuracy_score >= 60 else "N"
+    except:
+        accuracy_score = "N/A"
+        final_score = "N/A"
+
+    return {
+        "ID": df["Answer ID"][index],
+        "Key Points": df_stack["Key Points"][index],
+        "Answer": df["gpt_Generated_Response"][index],
+        "RAG Key Points": df_RAG["Key Points"][index],
+        "LLM Method Result": explanation,
+        "Score": final_score
+    }
+
+
+def grade_key(df, df_stack, df_RAG, index):
+    """
+    Journal key: row, Answer ID and a hash of both key-point texts, so grades of another test version
+    (same Answer IDs, different RAG key points) are never reused on --resume.
+    """
+    texts = str(df_stack["Key Points"][index]).strip() + "\0" + str(df_RAG["Key Points"][index]).strip()
+    return f"{index}/{df['Answer ID'][index]}/{text_hash(texts)[:16]}"
 
 
 # Evaluate RAG results
-async def evaluate_RAG_answer():
+async def evaluate_RAG_answer(resume=False):
+    """
+    Grades every row; each finished grade goes to `<results_csv>.journal.jsonl` right away.
+    With `resume`, rows already graded in an interrupted run are not sent again.
+    The journal is deleted once the results CSV has been written.
+    """
     df = pd.read_csv(input_csv)
     df_stack = pd.read_csv(keypoints_stack_csv)
     df_RAG = pd.read_csv(keypoints_RAG_csv)
 
-    results = []
-    
-    tasks = []
-    for index, row in df.iterrows():
+    journal = ResultJournal(journal_filename(results_csv), resume=resume)
+    keys = [grade_key(df, df_stack, df_RAG, index) for index in range(len(df))]
+
+    async def grade(index):
         key_points_stack = str(df_stack["Key Points"][index]).strip()
         key_points_RAG = str(df_RAG["Key Points"][index]).strip()
-        
+
         if not key_points_stack or not key_points_RAG:
-            explanation = "Similarity Score: N/A\nReasoning: Missing Data"
-            final_score = "N/A"
-        else:
-            tasks.append(evaluate_generated_answer(key_points_stack, key_points_RAG))
-
-    explanations = await asyncio.gather(*tasks)
-
-    for index, explanation in enumerate(explanations):
-        explanation_soup = BeautifulSoup(explanation, 'html.parser')
-        try:
-            accuracy_score = int(explanation_soup.find("accuracy_score").contents[0])
-            final_score = "Y" if accuracy_score >= 60 else "N"
-        except:
-            accuracy_score = "N/A"
-            final_score = "N/A"
-
-        results.append({
-            "ID": df["Answer ID"][index],
-            "Key Points": df_stack["Key Points"][index],
-            "Answer": df["gpt_Generated_Response"][index],
-            "RAG Key Points": df_RAG["Key Points"][index],
-            "LLM Method Result": explanation,
-            "Score": final_score
-        })
-
-    output_csv = "LLM_keypoint_results.csv"
+            return "Similarity Score: N/A\nReasoning: Missing Data"
+        explanation = await evaluate_generated_answer(key_points_stack, key_points_RAG)
+        # API 错误不写入 journal，resume 时会重新请求
+        if not explanation.startswith("API Error"):
+            journal.append(keys[index], explanation)
+        return explanation
+
+    pending = [index for index in range(len(df)) if keys[index] not in journal]
+    if resume:
+        print(f"Resuming: {len(df) - len(pending)} rows already graded, {len(pending)} to go")
+    explanations = dict(zip(pending, await asyncio.gather(*[grade(index) for index in pending])))
+    journal.close()
+
+    results = []
+    for index in range(len(df)):
+        explanation = explanations.get(index, journal.get(keys[index]))
+        results.append(result_row(df, df_stack, df_RAG, index, explanation))
+
+    output_csv = results_csv
     pd.DataFrame(results).to_csv(output_csv, index=False)
     print(f"Comparison completed. Results saved to {output_csv}")
+    journal.remove()
 
 # Run async functions
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Key point extraction and grading")
+    parser.add_argument("--resume", action="store_true",
+                        help="only grade rows missing from the journal of an interrupted run")
+    args = parser.parse_args()
+    telemetry = llm_telemetry.start("LLM_keypoint")
+
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:
         loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(save_keypoints())
-    loop.run_until_complete(evaluate_RAG_answer())
\ No newline at end of file
+    loop.run_until_complete(evaluate_RAG_answer(resume=args.resume))
+    print(get_cache().stats())
+    telemetry.write(results_csv)
@@ -1,10 +1,21 @@
 import os
+import sys
 import openai
 import pandas as pd
 import asyncio
-import time
 from bs4 import BeautifulSoup
 
+# Entry script: the repository root (llm_telemetry, result_journal) goes on sys.path here, once;
+# library modules such as llm_client just import from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from llm_cache import get_cache
+from llm_client import get_client
+from keypoint_store import extract_with_store, prompt_version
+import llm_telemetry
+
 # os.environ["http_proxy"] = "http://localhost:7890"
 # os.environ["https_proxy"] = "http://localhost:7890"
 
@@ -16,10 +27,8 @@ input_csv = "input_data.csv"
 keypoints_stack_csv = "keypoints_stack.csv"
 keypoints_RAG_csv = "keypoints_RAG.csv"
 
-#async to imporve speed:
-async def extract_key_points_from_text(text):
-
-    prompt = f"""
+def build_keypoint_prompt(text):
+    return f"""
     You are an expert summarizer and familiar with Kubernetes. You will recieve an "Answer" (Text) to a problem.
     This "Answer" includes a textual description and code snippets. The description is usually a normal sentence, while the code consists of a series of words. Please try to distinguish them.
     In code snippets, not every word is important. And important code content is often reflected in the description.
@@ -76,54 +85,47 @@ async def extract_key_points_from_text(text):
     {text}
     """
 
-    for attempt in range(3):  # Retry up to 3 times
-        try:
-            response = await asyncio.to_thread(
-                openai.chat.completions.create,  # Runs the blocking function in a thread
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0
-            )
-            return response.choices[0].message.content.strip()  # Successful response
-        except openai.RateLimitError:
-            print(f"Rate limit error, retrying ({attempt+1}/3)...")
-            time.sleep(2 ** attempt)  # Uses time.sleep() instead of async sleep
-        except openai.OpenAIError as e:
-            print(f"OpenAI API Error: {e}")
-            return "API Error"
-
-    return "API Error: Max retries exceeded."
-
-
-# Check if we can reuse keypoints_stack.csv
-def can_use_existing_keypoints(margin=10):
-    if os.path.exists(keypoints_stack_csv):
-        df_input = pd.read_csv(input_csv)
-        df_stack = pd.read_csv(keypoints_stack_csv)
-
-        # Check if the row count is within margin
-        return abs(len(df_input) - len(df_stack)) <= margin
-    return False
+
+# Stored key points are only reused for the same model and prompt template
+KEYPOINT_PROMPT_VERSION = prompt_version(build_keypoint_prompt, "gpt-4o-mini")
+
+
+#async to imporve speed:
+async def extract_key_points_from_text(text):
+    prompt = build_keypoint_prompt(text)
+
+    try:
+        # Shared client: bounded concurrency, RPM/TPM limits, non-blocking backoff with jitter
+        content = await get_client().chat(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0
+        )
+        return content.strip()  # Successful response
+    except openai.RateLimitError:
+        print("Rate limit error, max retries exceeded.")
+        return "API Error: Max retries exceeded."
+    except openai.OpenAIError as e:
+        print(f"OpenAI API Error: {e}")
+        return "API Error"
+
 
 # Save key points extracted from CSV
 async def save_keypoints():
     df = pd.read_csv(input_csv)
-    
-    key_points_list_1 = []
-    key_points_list_2 = []
-
-    if can_use_existing_keypoints(margin=10):
-        print("Reusing existing keypoints_stack.csv")
-        df_stack = pd.read_csv(keypoints_stack_csv)
-        key_points_list_1 = df_stack["Key Points"].tolist()
-    else:
-        print("Extracting new key points for stack answers...")
-        key_points_list_1 = await asyncio.gather(*[extract_key_points_from_text(str(row["Answer Body"]).strip()) for _, row in df.iterrows()])
-        pd.DataFrame({"Key Points": key_points_list_1}).to_csv(keypoints_stack_csv, index=False)
-    
-    print("Extracting new key points for RAG answers...")
-    key_points_list_2 = await asyncio.gather(*[extract_key_points_from_text(str(row["gpt_Generated_Response"]).strip()) for _, row in df.iterrows()])
-    
+
+    # 按 Answer ID + 文本哈希 + prompt 版本查库，只抽取新增或改动过的回答
+    print("Extracting key points for stack answers...")
+    key_points_list_1 = await extract_with_store(
+        df["Answer ID"], [str(text).strip() for text in df["Answer Body"]],
+        extract_key_points_from_text, KEYPOINT_PROMPT_VERSION, "Stack answers")
+    pd.DataFrame({"Key Points": key_points_list_1}).to_csv(keypoints_stack_csv, index=False)
+
+    print("Extracting key points for RAG answers...")
+    key_points_list_2 = await extract_with_store(
+        df["Answer ID"], [str(text).strip() for text in df["gpt_Generated_Response"]],
+        extract_key_points_from_text, KEYPOINT_PROMPT_VERSION, "RAG answers")
+
     pd.DataFrame({"Key Points": key_points_list_2}).to_csv(keypoints_RAG_csv, index=False)
     print("Key point extraction completed.")
 
@@ -157,23 +159,20 @@ async def evaluate_generated_answer(text1, text2):
     </evaluation>
     """
 
-    for attempt in range(3):  # Retry up to 3 times
-        try:
-            response = await asyncio.to_thread(
-                openai.chat.completions.create,  # Runs the blocking function in a thread
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0
-            )
-            return response.choices[0].message.content.strip()  # Successfully returns async result
-        except openai.RateLimitError:
-            print(f"⚠️ Rate limit error, retrying ({attempt+1}/3)...")
-            await asyncio.sleep(2 ** attempt)  # Uses proper async wait
-        except openai.OpenAIError as e:
-            print(f"❌ OpenAI API Error: {e}")
-            return "API Error"
-
-    return "API Error: Max retries exceeded."
+    try:
+        # Shared client: bounded concurrency, RPM/TPM limits, non-blocking backoff with jitter
+        content = await get_client().chat(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0
+        )
+        return content.strip()  # Successfully returns async result
+    except openai.RateLimitError:
+        print("⚠️ Rate limit error, max retries exceeded.")
+        return "API Error: Max retries exceeded."
+    except openai.OpenAIError as e:
+        print(f"❌ OpenAI API Error: {e}")
+        return "API Error"
 
 
 # Evaluate RAG results
@@ -221,10 +220,13 @@ async def evaluate_RAG_answer():
 
 # Run async functions
 if __name__ == "__main__":
+    telemetry = llm_telemetry.start("LLM_keypoint_new")
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:
         loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(save_keypoints())
-    loop.run_until_complete(evaluate_RAG_answer())
\ No newline at end of file
+    loop.run_until_complete(evaluate_RAG_answer())
+    print(get_cache().stats())
+    telemetry.write("LLM_keypoint_results.csv")
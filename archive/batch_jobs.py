@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import time
+import uuid
+
+import openai
+import pandas as pd
+
+import LLM_keypoint as keypoint
+from keypoint_store import get_store, store_keys
+from llm_cache import cache_key, get_cache
+
+# Same model / params as the online path in LLM_keypoint, so both share cache entries
+MODEL = "gpt-4o-mini"
+PARAMS = {"temperature": 0.0}
+BATCH_DIR = "batch_jobs"
+
+
+def batch_request(custom_id, prompt):
+    """ One line of a chat-completions batch request file. """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": MODEL, "messages": [{"role": "user", "content": prompt}], **PARAMS},
+    }
+
+
+def write_requests(requests, filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return filename
+
+
+def parse_output_line(line):
+    """ (custom_id, content or None) from one line of a batch output file. """
+    item = json.loads(line)
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        return item["custom_id"], None
+    return item["custom_id"], response["body"]["choices"][0]["message"]["content"]
+
+
+class OpenAIBatchBackend:
+    """ OpenAI Batch API: upload the request file, create a 24h batch, download the output file. """
+
+    def submit(self, request_filename):
+        with open(request_filename, "rb") as f:
+            input_file = openai.files.create(file=f, purpose="batch")
+        batch = openai.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+        return batch.id
+
+    def status(self, job_id):
+        status = openai.batches.retrieve(job_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    def results(self, job_id):
+        batch = openai.batches.retrieve(job_id)
+        if not batch.output_file_id:
+            return {}
+        text = openai.files.content(batch.output_file_id).text
+        return dict(parse_output_line(line) for line in text.splitlines() if line.strip())
+
+
+def stub_responder(body):
+    """ Deterministic stand-in answer: echoes a short key point, grades every pair at 60. """
+    prompt = body["messages"][0]["content"]
+    if "<evaluation>" in prompt:
+        return "<accuracy_score>60</accuracy_score>\n<reasoning>local stub</reasoning>"
+    return f"### **Key Points:**\n1. stub key point ({len(prompt)} chars)"
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for testing: a job is a directory holding the request file;
+    the first status poll answers every request with `responder` and writes an output file
+    in the same format as the OpenAI Batch API.
+    """
+
+    def __init__(self, directory=BATCH_DIR, responder=stub_responder):
+        self.directory = directory
+        self.responder = responder
+        os.makedirs(directory, exist_ok=True)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, request_filename):
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._job_dir(job_id))
+        os.replace(request_filename, os.path.join(self._job_dir(job_id), "input.jsonl"))
+        return job_id
+
+    def status(self, job_id):
+        output_filename = os.path.join(self._job_dir(job_id), "output.jsonl")
+        if not os.path.exists(output_filename):
+            with open(os.path.join(self._job_dir(job_id), "input.jsonl"), "r", encoding="utf-8") as f_in, \
+                    open(output_filename, "w", encoding="utf-8") as f_out:
+                for line in f_in:
+                    request = json.loads(line)
+                    content = self.responder(request["body"])
+                    f_out.write(json.dumps({
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+                        "error": None,
+                    }, ensure_ascii=False) + "\n")
+        return "completed"
+
+    def results(self, job_id):
+        with open(os.path.join(self._job_dir(job_id), "output.jsonl"), "r", encoding="utf-8") as f:
+            return dict(parse_output_line(line) for line in f if line.strip())
+
+
+def wait_for(backend, job_id, poll_interval=30, timeout=None):
+    """ Polls until the job is done; returns its results {custom_id: content}. """
+    started = time.time()
+    while True:
+        status = backend.status(job_id)
+        if status == "completed":
+            return backend.results(job_id)
+        if status == "failed":
+            raise RuntimeError(f"Batch job {job_id} failed")
+        if timeout is not None and time.time() - started > timeout:
+            raise TimeoutError(f"Batch job {job_id} not finished after {timeout}s")
+        print(f"Batch job {job_id}: {status}, polling again in {poll_interval}s...")
+        time.sleep(poll_interval)
+
+
+def run_batch(backend, prompts, name, poll_interval=30):
+    """
+    Sends {custom_id: prompt} through the batch backend and returns {custom_id: content}.
+    Prompts already in the LLM cache are answered locally and never submitted.
+    """
+    cache = get_cache()
+    answers = {}
+    requests = []
+    for custom_id, prompt in prompts.items():
+        messages = [{"role": "user", "content": prompt}]
+        cached = cache.get(cache_key(MODEL, messages, **PARAMS))
+        if cached is not None:
+            answers[custom_id] = cached.strip()
+        else:
+            requests.append(batch_request(custom_id, prompt))
+
+    print(f"{name}: {len(answers)} answered from cache, {len(requests)} submitted as a batch")
+    if requests:
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        request_filename = write_requests(requests, os.path.join(BATCH_DIR, f"{name}_requests.jsonl"))
+        job_id = backend.submit(request_filename)
+        print(f"{name}: submitted batch job {job_id}")
+        results = wait_for(backend, job_id, poll_interval)
+
+        prompts_by_id = {request["custom_id"]: request["body"]["messages"] for request in requests}
+        for custom_id, content in results.items():
+            if content:
+                cache.put(cache_key(MODEL, prompts_by_id[custom_id], **PARAMS), content)
+                content = content.strip()
+            answers[custom_id] = content if content else "API Error"
+    return answers
+
+
+def batch_keypoints(backend, poll_interval=30):
+    """ Batch version of LLM_keypoint.save_keypoints + evaluate_RAG_answer, same three output CSVs. """
+    df = pd.read_csv(keypoint.input_csv)
+
+    # Key points already in the keypoint store (same Answer ID, text and prompt version) are not resubmitted
+    store = get_store()
+    columns = {"stack": "Answer Body", "rag": "gpt_Generated_Response"}
+    texts = {name: [str(text).strip() for text in df[column]] for name, column in columns.items()}
+    keys = {name: store_keys(df["Answer ID"], texts[name], keypoint.KEYPOINT_PROMPT_VERSION) for name in columns}
+    stored = {name: store.get_many(keys[name]) for name in columns}
+
+    prompts = {}
+    for name in columns:
+        for index in range(len(df)):
+            if keys[name][index] not in stored[name]:
+                prompts[f"{name}-{index}"] = keypoint.build_keypoint_prompt(texts[name][index])
+    print(f"Keypoint store: {2 * len(df) - len(prompts)} key points reused, {len(prompts)} to extract")
+    answers = run_batch(backend, prompts, "keypoints", poll_interval)
+
+    key_points = {}
+    for name in columns:
+        key_points[name] = []
+        for index in range(len(df)):
+            key = keys[name][index]
+            # Results are mapped back by custom_id, so row order never depends on the batch output order
+            content = stored[name].get(key) or answers.get(f"{name}-{index}", "API Error")
+            if key not in stored[name] and not content.startswith("API Error"):
+                store.put(key, content)
+            key_points[name].append(content)
+    pd.DataFrame({"Key Points": key_points["stack"]}).to_csv(keypoint.keypoints_stack_csv, index=False)
+    pd.DataFrame({"Key Points": key_points["rag"]}).to_csv(keypoint.keypoints_RAG_csv, index=False)
+    print("Key point extraction completed.")
+
+    df_stack = pd.read_csv(keypoint.keypoints_stack_csv)
+    df_RAG = pd.read_csv(keypoint.keypoints_RAG_csv)
+    prompts = {
+        f"eval-{index}": keypoint.build_evaluation_prompt(str(df_stack["Key Points"][index]).strip(),
+                                                          str(df_RAG["Key Points"][index]).strip())
+        for index in range(len(df))
+    }
+    explanations = run_batch(backend, prompts, "evaluation", poll_interval)
+
+    results = [keypoint.result_row(df, df_stack, df_RAG, index, explanations.get(f"eval-{index}", "API Error"))
+               for index in range(len(df))]
+    pd.DataFrame(results).to_csv(keypoint.results_csv, index=False)
+    print(f"Comparison completed. Results saved to {keypoint.results_csv}")
+    print(get_cache().stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keypoint extraction and grading through batch jobs")
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    parser.add_argument("--poll-interval", type=int, default=60)
+    args = parser.parse_args()
+
+    backend = OpenAIBatchBackend() if args.backend == "openai" else LocalBatchBackend()
+    batch_keypoints(backend, args.poll_interval)
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import openai
+import pandas as pd
+from bs4 import BeautifulSoup
+
+# Entry script: the repository root (llm_telemetry, result_journal) goes on sys.path here, once;
+# library modules such as llm_client just import from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from embedding_compare import batch_cosine_similarity, classify_answer, get_engine
+from LLM_compare import evaluate_generated_answer
+from llm_cache import get_cache
+import llm_telemetry
+
+BORDERLINE = "Borderline (Needs LLM Evaluation)"
+# Same pass mark as the keypoint grader (LLM_keypoint_new): accuracy_score >= 60 -> Correct
+LLM_PASS_SCORE = 60
+
+
+def parse_accuracy_score(explanation):
+    """ <accuracy_score> from a grader reply, None if missing or not a number. """
+    try:
+        return int(BeautifulSoup(explanation, "html.parser").find("accuracy_score").contents[0])
+    except Exception:
+        return None
+
+
+def llm_label(explanation, pass_score=LLM_PASS_SCORE):
+    score = parse_accuracy_score(explanation)
+    if score is None:
+        return "N/A"
+    return "Correct" if score >= pass_score else "Incorrect"
+
+
+async def grade_rows(pairs):
+    """ LLM-grades {row: (text1, text2)}; returns ({row: explanation}, [seconds per call]). """
+    latencies = []
+
+    async def grade(text1, text2):
+        started = time.perf_counter()
+        try:
+            return await evaluate_generated_answer(text1, text2)
+        except openai.OpenAIError as e:
+            print(f"OpenAI API Error: {e}")
+            return "API Error"
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    rows = list(pairs)
+    explanations = await asyncio.gather(*[grade(*pairs[row]) for row in rows])
+    return dict(zip(rows, explanations)), latencies
+
+
+async def grade_passes(*passes):
+    """
+    Runs several grade_rows passes one after another inside a single event loop
+    (the shared client's semaphore / buckets belong to the loop that first used them).
+    Returns [(explanations, latencies, wall seconds)] per pass.
+    """
+    results = []
+    for pairs in passes:
+        started = time.perf_counter()
+        explanations, latencies = await grade_rows(pairs)
+        results.append((explanations, latencies, time.perf_counter() - started))
+    return results
+
+
+def cascade_compare(df, high_threshold=0.9, low_threshold=0.7, pass_score=LLM_PASS_SCORE, full_llm=False):
+    """
+    Embedding pass over every row, LLM grader only on rows whose similarity falls
+    between the thresholds. Returns (result rows, report dict).
+    With `full_llm`, every row is also LLM-graded to measure agreement with the cascade.
+    """
+    texts1 = [str(text).strip() for text in df["StackOverflow Answer"]]
+    texts2 = [str(text).strip() for text in df["Previous RAG Answer"]]
+    valid = [i for i in range(len(df)) if texts1[i] and texts2[i]]
+
+    started = time.perf_counter()
+    scores = dict(zip(valid, batch_cosine_similarity([texts1[i] for i in valid], [texts2[i] for i in valid])))
+    embedding_seconds = time.perf_counter() - started
+    embedding_labels = {i: classify_answer(float(scores[i]), high_threshold, low_threshold) for i in valid}
+
+    borderline = [i for i in valid if embedding_labels[i] == BORDERLINE]
+    passes = [{i: (texts1[i], texts2[i]) for i in borderline}]
+    if full_llm:
+        passes.append({i: (texts1[i], texts2[i]) for i in valid})
+    graded = asyncio.run(grade_passes(*passes))
+    explanations, latencies, llm_seconds = graded[0]
+
+    results = []
+    labels = {}
+    for index in range(len(df)):
+        if index not in scores:
+            label, method, explanation, similarity = "Missing Data", "none", "", "N/A"
+        elif index in explanations:
+            label, method, explanation = llm_label(explanations[index], pass_score), "llm", explanations[index]
+            similarity = f"{scores[index]:.4f}"
+        else:
+            label, method, explanation = embedding_labels[index], "embedding", ""
+            similarity = f"{scores[index]:.4f}"
+        labels[index] = label
+        results.append({"ID": df["ID"][index], "Similarity Score": similarity, "Decided By": method,
+                        "Cascade Result": label, "LLM Method Result": explanation})
+
+    mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+    calls_saved = len(valid) - len(borderline)
+    report = {
+        "rows": len(df),
+        "thresholds": {"high": high_threshold, "low": low_threshold, "llm_pass_score": pass_score},
+        "embedding_decided": calls_saved,
+        "llm_calls": len(borderline),
+        "llm_calls_saved": calls_saved,
+        "llm_calls_saved_ratio": calls_saved / len(valid) if valid else 0.0,
+        "embedding_seconds": round(embedding_seconds, 3),
+        "llm_seconds": round(llm_seconds, 3),
+        "mean_llm_call_seconds": round(mean_latency, 3),
+        # 省下的调用 × 实测单次调用耗时（顺序执行时的估计；并发时实际墙钟节省更少）
+        "estimated_llm_seconds_saved": round(calls_saved * mean_latency, 3),
+    }
+
+    if full_llm:
+        full_explanations = graded[1][0]
+        full_labels = {i: llm_label(full_explanations[i], pass_score) for i in valid}
+        decided = [i for i in valid if i not in explanations and full_labels[i] != "N/A"]
+        comparable = [i for i in valid if full_labels[i] != "N/A" and labels[i] != "N/A"]
+        report["agreement"] = {
+            "rows_compared": len(comparable),
+            "overall": sum(labels[i] == full_labels[i] for i in comparable) / len(comparable) if comparable else None,
+            # 只有 embedding 直接判定的行才可能和全量 LLM 结果不同
+            "embedding_decided_rows": len(decided),
+            "embedding_decided_agreement": sum(labels[i] == full_labels[i] for i in decided) / len(decided) if decided else None,
+            "false_correct": sum(labels[i] == "Correct" and full_labels[i] == "Incorrect" for i in decided),
+            "false_incorrect": sum(labels[i] == "Incorrect" and full_labels[i] == "Correct" for i in decided),
+        }
+        for index, row in enumerate(results):
+            row["Full LLM Result"] = full_labels.get(index, "Missing Data")
+
+    return results, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding-first cascade: LLM grader only for borderline pairs")
+    parser.add_argument("--input", default="input_data.csv")
+    parser.add_argument("--output", default="cascade_comparison_results.csv")
+    parser.add_argument("--high", type=float, default=0.9, help="similarity >= high -> Correct without LLM")
+    parser.add_argument("--low", type=float, default=0.7, help="similarity < low -> Incorrect without LLM")
+    parser.add_argument("--pass-score", type=int, default=LLM_PASS_SCORE, help="LLM accuracy_score counted as Correct")
+    parser.add_argument("--full-llm", action="store_true", help="also grade every row with the LLM and report agreement")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    if "StackOverflow Answer" not in df.columns or "Previous RAG Answer" not in df.columns:
+        raise ValueError("CSV must contain 'StackOverflow Answer' and 'Previous RAG Answer' columns")
+
+    telemetry = llm_telemetry.start("cascade_compare")
+    results, report = cascade_compare(df, args.high, args.low, args.pass_score, args.full_llm)
+    pd.DataFrame(results).to_csv(args.output, index=False)
+    report_filename = args.output.rsplit(".", 1)[0] + "_report.json"
+    with open(report_filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+    print(json.dumps(report, indent=4))
+    print(f"Cascade completed. Results saved to {args.output}, report to {report_filename}")
+    print(f"Embedding requests: {get_engine().requests}")
+    print(get_cache().stats())
+    telemetry.write(args.output)
@@ -1,28 +1,44 @@
 import os
+import sys
 import openai
 import pandas as pd
-import numpy as np
-from scipy.spatial.distance import cosine
+
+# Entry script: the repository root (llm_telemetry, result_journal) goes on sys.path here, once;
+# library modules such as llm_client just import from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import llm_telemetry
+from embedding_engine import EmbeddingEngine, rowwise_cosine
 
 # Load API key from environment variable
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# Function to get embeddings from OpenAI API
+_engine = None
+
+
+def get_engine():
+    """ Shared engine; backend from EMBEDDING_BACKEND (openai / local / stub). """
+    global _engine
+    if _engine is None:
+        _engine = EmbeddingEngine()
+    return _engine
+
+# Function to get embeddings (batched, cached on disk by text hash)
 def get_embedding(text):
-    """Fetches embedding for a given text using OpenAI API."""
-    response = openai.embeddings.create(
-        model="text-embedding-ada-002",
-        input=[text]
-    )
-    return response.data[0].embedding
+    """Fetches embedding for a given text."""
+    return get_engine().embed([text])[0]
 
 # Function to compute cosine similarity
 def cosine_similarity(text1, text2):
     """Computes cosine similarity between two texts."""
-    emb1 = get_embedding(text1)
-    emb2 = get_embedding(text2)
-    similarity = 1 - cosine(emb1, emb2)  # Cosine similarity formula
-    return similarity
+    return float(rowwise_cosine(get_engine().embed([text1]), get_engine().embed([text2]))[0])
+
+def batch_cosine_similarity(texts1, texts2):
+    """Cosine similarity of every (texts1[i], texts2[i]) pair: one batched embedding pass, one vectorized product."""
+    vectors = get_engine().embed(list(texts1) + list(texts2))
+    return rowwise_cosine(vectors[:len(texts1)], vectors[len(texts1):])
 
 # Function to classify similarity score
 def classify_answer(similarity_score, high_threshold=0.9, low_threshold=0.7):
@@ -39,33 +55,39 @@ def classify_answer(similarity_score, high_threshold=0.9, low_threshold=0.7):
     else:
         return "Borderline (Needs LLM Evaluation)"
 
-# Load CSV file
-input_csv = "input_data.csv"  # Replace with your actual filename
-df = pd.read_csv(input_csv)
-
-# Ensure required columns exist
-if "StackOverflow Answer" not in df.columns or "Previous RAG Answer" not in df.columns:
-    raise ValueError("CSV must contain 'StackOverflow Answer' and 'Previous RAG Answer' columns")
-
-# Process each row
-results = []
-for index, row in df.iterrows():
-    text1 = str(row["StackOverflow Answer"])  # Convert to string in case of NaN values
-    text2 = str(row["Previous RAG Answer"])
-    
-    if not text1.strip() or not text2.strip():
-        similarity_score = "N/A"
-        classification = "Missing Data"
-    else:
-        similarity_score = cosine_similarity(text1, text2)
-        classification = classify_answer(similarity_score)
-    
-    result_text = f"Similarity Score: {similarity_score:.4f}\nClassification: {classification}"
-    results.append({"ID": row["ID"], "Embedding Method Result": result_text})
-
-# Save results to CSV
-output_csv = "embedding_comparison_results.csv"
-output_df = pd.DataFrame(results)
-output_df.to_csv(output_csv, index=False)
-
-print(f"Comparison completed. Results saved to {output_csv}")
+def compare_embeddings(input_csv="input_data.csv", output_csv="embedding_comparison_results.csv"):
+    df = pd.read_csv(input_csv)
+
+    # Ensure required columns exist
+    if "StackOverflow Answer" not in df.columns or "Previous RAG Answer" not in df.columns:
+        raise ValueError("CSV must contain 'StackOverflow Answer' and 'Previous RAG Answer' columns")
+
+    texts1 = [str(text) for text in df["StackOverflow Answer"]]  # Convert to string in case of NaN values
+    texts2 = [str(text) for text in df["Previous RAG Answer"]]
+    valid = [i for i in range(len(df)) if texts1[i].strip() and texts2[i].strip()]
+    scores = batch_cosine_similarity([texts1[i] for i in valid], [texts2[i] for i in valid])
+    score_by_row = dict(zip(valid, scores))
+
+    results = []
+    for index, row in df.iterrows():
+        if index not in score_by_row:
+            result_text = "Similarity Score: N/A\nClassification: Missing Data"
+        else:
+            similarity_score = float(score_by_row[index])
+            classification = classify_answer(similarity_score)
+            result_text = f"Similarity Score: {similarity_score:.4f}\nClassification: {classification}"
+        results.append({"ID": row["ID"], "Embedding Method Result": result_text})
+
+    # Save results to CSV
+    output_df = pd.DataFrame(results)
+    output_df.to_csv(output_csv, index=False)
+
+    print(f"Comparison completed. Results saved to {output_csv}")
+    print(f"Embedding requests: {get_engine().requests} for {len(valid)} rows")
+    return output_df
+
+
+if __name__ == "__main__":
+    telemetry = llm_telemetry.start("embedding_compare")
+    compare_embeddings()
+    telemetry.write("embedding_comparison_results.csv")
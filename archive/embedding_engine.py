@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+# Persistent embedding store: embeddings/<backend name>/
+#   vectors.f32   float32 matrix (capacity x dim), memory-mapped
+#   keys.txt      sha256 of the text stored in each row, one per line (row = line number)
+#   meta.json     dim / capacity
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "embeddings")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class OpenAIEmbeddingBackend:
+    """ Remote embeddings, many texts per request. """
+
+    def __init__(self, model="text-embedding-ada-002", batch_size=256):
+        self.model = model
+        self.batch_size = batch_size
+        self.name = model
+
+    def embed(self, texts):
+        import openai
+
+        response = openai.embeddings.create(model=self.model, input=texts)
+        return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+
+class SentenceTransformerBackend:
+    """ Local CPU model (pip install sentence-transformers), no network calls. """
+
+    def __init__(self, model="all-MiniLM-L6-v2", batch_size=64):
+        from sentence_transformers import SentenceTransformer
+
+        self.encoder = SentenceTransformer(model, device="cpu")
+        self.batch_size = batch_size
+        self.name = model.replace("/", "_")
+
+    def embed(self, texts):
+        return np.asarray(self.encoder.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+
+class StubEmbeddingBackend:
+    """ Deterministic hashed bag-of-words vectors, for tests and offline dry runs. """
+
+    def __init__(self, dim=256, batch_size=1024):
+        self.dim = dim
+        self.batch_size = batch_size
+        self.name = f"stub-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                h = int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+                vectors[i, h % self.dim] += 1.0 if h & (1 << 31) else -1.0
+        return vectors
+
+
+def get_backend(name=None):
+    """ Backend from EMBEDDING_BACKEND: openai (default), local or stub. """
+    name = name or os.getenv("EMBEDDING_BACKEND", "openai")
+    if name == "stub":
+        return StubEmbeddingBackend()
+    if name == "local":
+        return SentenceTransformerBackend()
+    return OpenAIEmbeddingBackend()
+
+
+class EmbeddingStore:
+    """ Append-only float32 matrix on disk, rows looked up by text hash. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.keys_filename = os.path.join(directory, "keys.txt")
+        self.vectors_filename = os.path.join(directory, "vectors.f32")
+        self.meta_filename = os.path.join(directory, "meta.json")
+
+        self.rows = {}
+        if os.path.exists(self.keys_filename):
+            with open(self.keys_filename, "r", encoding="utf-8") as f:
+                for row, key in enumerate(f):
+                    self.rows[key.strip()] = row
+        self.dim = None
+        self.capacity = 0
+        self.vectors = None
+        if os.path.exists(self.meta_filename):
+            with open(self.meta_filename, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.capacity = meta["dim"], meta["capacity"]
+            self.vectors = np.memmap(self.vectors_filename, dtype=np.float32, mode="r+",
+                                     shape=(self.capacity, self.dim))
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def _save_meta(self):
+        with open(self.meta_filename, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity}, f)
+
+    def _reserve(self, n_rows, dim):
+        """ Grows the memory-mapped file (doubling) so `n_rows` rows fit. """
+        if self.dim is None:
+            self.dim = dim
+        if n_rows <= self.capacity:
+            return
+        new_capacity = max(n_rows, self.capacity * 2, 1024)
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(self.vectors_filename, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.capacity = new_capacity
+        self.vectors = np.memmap(self.vectors_filename, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._save_meta()
+
+    def add(self, keys, vectors):
+        start = len(self.rows)
+        self._reserve(start + len(keys), vectors.shape[1])
+        self.vectors[start:start + len(keys)] = vectors
+        self.vectors.flush()
+        # 先写向量再写 key，中途退出最多丢掉这一批，不会出现 key 指向空行
+        with open(self.keys_filename, "a", encoding="utf-8") as f:
+            for offset, key in enumerate(keys):
+                f.write(key + "\n")
+                self.rows[key] = start + offset
+
+    def get(self, keys):
+        return np.asarray(self.vectors[[self.rows[key] for key in keys]])
+
+
+class EmbeddingEngine:
+    """ Embeds texts in large batches, each distinct text only once across runs. """
+
+    def __init__(self, backend=None, directory=None):
+        self.backend = backend or get_backend()
+        self.store = EmbeddingStore(directory or os.path.join(EMBEDDING_DIR, self.backend.name))
+        self.requests = 0
+
+    def embed(self, texts):
+        keys = [text_hash(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.store and key not in missing:
+                missing[key] = text
+
+        missing_keys = list(missing)
+        batch_size = self.backend.batch_size
+        for start in range(0, len(missing_keys), batch_size):
+            batch_keys = missing_keys[start:start + batch_size]
+            vectors = self.backend.embed([missing[key] for key in batch_keys])
+            self.requests += 1
+            self.store.add(batch_keys, vectors)
+
+        if not keys:
+            return np.zeros((0, self.store.dim or 0), dtype=np.float32)
+        return self.store.get(keys)
+
+
+def rowwise_cosine(a, b):
+    """ Cosine similarity of a[i] and b[i] for every row at once. """
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    dots = np.einsum("ij,ij->i", a, b)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Extracted key points, keyed by (Answer ID, sha256 of the answer text, prompt version).
+# A changed answer or a changed prompt is a new key, so stale key points are never reused,
+# and lookups do not depend on row order in input_data.csv.
+KEYPOINT_STORE_PATH = os.getenv("KEYPOINT_STORE_PATH", "keypoint_store.sqlite")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_version(build_prompt, model):
+    """ Hash of the model and the prompt template, so editing the prompt invalidates old key points. """
+    template = build_prompt("\0TEXT\0")
+    return hashlib.sha256(f"{model}\0{template}".encode("utf-8")).hexdigest()[:16]
+
+
+class KeypointStore:
+    def __init__(self, path=KEYPOINT_STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS keypoints (
+                answer_id TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                key_points TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (answer_id, text_hash, prompt_version)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT key_points FROM keypoints WHERE answer_id = ? AND text_hash = ? AND prompt_version = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        found = {}
+        for key in set(keys):
+            key_points = self.get(key)
+            if key_points is not None:
+                found[key] = key_points
+        return found
+
+    def put(self, key, key_points):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO keypoints VALUES (?, ?, ?, ?, ?)", (*key, key_points, time.time()))
+            self.conn.commit()
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = KeypointStore()
+    return _store
+
+
+def store_keys(answer_ids, texts, version):
+    return [(str(answer_id), text_hash(text), version) for answer_id, text in zip(answer_ids, texts)]
+
+
+async def extract_with_store(answer_ids, texts, extract, version, label="key points"):
+    """
+    Key points for every (answer_id, text), in input order. Only keys missing from the store are sent
+    to `extract` (an async text -> key points function); successful results are stored.
+    """
+    store = get_store()
+    keys = store_keys(answer_ids, texts, version)
+    found = store.get_many(keys)
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    print(f"{label}: {len(keys) - sum(key not in found for key in keys)} reused from {store.path}, "
+          f"{len(missing)} to extract")
+
+    extracted = await asyncio.gather(*[extract(text) for text in missing.values()])
+    for key, key_points in zip(missing, extracted):
+        # API 错误不入库，下次运行会重新抽取
+        if not key_points.startswith("API Error"):
+            store.put(key, key_points)
+        found[key] = key_points
+    return [found[key] for key in keys]
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import openai
+
+# On-disk cache of chat completions, shared by the keypoint / compare scripts.
+# Key = sha256(model + messages + params), so identical prompts are only paid for once.
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+# Least recently used entries are evicted once the cached texts exceed this size
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+def cache_key(model, messages, **params):
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """ Size-bounded LRU cache in SQLite. Safe to share between the threads used by asyncio.to_thread. """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, value, size, time.time()))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 按最近使用时间从旧到新删除，直到总大小回到上限以内
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        return f"LLM cache: {self.hits} hits, {self.misses} misses ({self.path})"
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
+
+
+def cached_chat_completion(model, messages, **params):
+    """
+    Same call as openai.chat.completions.create but returns the message content,
+    answered from the cache when this exact model / prompt / params was seen before.
+    """
+    key = cache_key(model, messages, **params)
+    content = get_cache().get(key)
+    if content is not None:
+        return content
+    return fetch_and_cache(key, model, messages, **params)
+
+
+def fetch_and_cache(key, model, messages, client=None, **params):
+    """ Calls the API (cache already missed) and stores the reply under `key`. `client` defaults to the openai module client. """
+    response = (client or openai).chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content
+    # 出错（抛异常）或空回复不缓存
+    if content:
+        get_cache().put(key, content)
+    return content
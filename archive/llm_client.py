@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import llm_telemetry
+from llm_cache import cache_key, fetch_and_cache, get_cache
+
+# Provider limits, overridable per run. Defaults fit gpt-4o-mini tier-1 style limits.
+# Concurrency is adaptive (AIMD): it starts at LLM_INITIAL_CONCURRENCY and moves between 1 and LLM_MAX_CONCURRENCY.
+INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", 8))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 64))
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+
+# Errors worth retrying with backoff; everything else goes straight back to the caller.
+# The SDK's own retries are off (max_retries=0), so 5xx responses have to be retried here too
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+# Errors that mean "too much in flight" and cut the adaptive concurrency limit
+OVERLOAD_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+
+
+def estimate_tokens(messages, completion_tokens=512):
+    """ Rough prompt + completion token count (~4 characters per token), good enough for rate limiting. """
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + completion_tokens
+
+
+class TokenBucket:
+    """ Async token bucket refilled continuously at `rate_per_minute`. """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # 一次请求超过桶容量时按容量算，否则永远等不到
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight requests, shared by every coroutine using the client:
+    +`increase` per limit's worth of successes while the limit is fully used (about +1 per round trip),
+    x`decrease` on a 429 / timeout. Only requests started after the last cut can cut again,
+    so one burst of 429s from the same window shrinks the limit once, not once per request.
+    """
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=1, maximum=MAX_CONCURRENCY, increase=1.0, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.last_cut = 0.0
+        self.started = time.monotonic()
+        self.history = [(0.0, int(self.limit), "start")]
+        self.condition = asyncio.Condition()
+
+    def _log(self, event):
+        elapsed = round(time.monotonic() - self.started, 3)
+        self.history.append((elapsed, int(self.limit), event))
+        llm_telemetry.sample("concurrency_limit", int(self.limit))
+
+    async def acquire(self):
+        """ Waits for a free slot; returns the start time to pass back to release. """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, outcome):
+        """ outcome: "success", "overload" (429 / timeout) or "error" (no change). """
+        async with self.condition:
+            self.in_flight -= 1
+            previous = int(self.limit)
+            # 只有并发真的用满时才加：被限流桶或调用方卡住时，上限不该凭空涨
+            if outcome == "success" and self.in_flight + 1 >= previous:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+                if int(self.limit) != previous:
+                    self._log("increase")
+            elif outcome == "overload" and started > self.last_cut:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.last_cut = time.monotonic()
+                # 已经在下限时不再记录/打印没有变化的 "decrease"
+                if int(self.limit) != previous:
+                    self._log("decrease")
+                    print(f"Rate limited: concurrency {previous} -> {int(self.limit)}")
+            self.condition.notify_all()
+
+
+class AsyncLLMClient:
+    """
+    Shared chat-completion client for the keypoint / compare scripts:
+    - adaptive number of requests in flight (AdaptiveConcurrency, capped at `max_concurrency`),
+    - requests/min and tokens/min token buckets,
+    - non-blocking exponential backoff with full jitter on 429s / timeouts.
+    Cached prompts (llm_cache) are answered without touching any limit.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=5, base_delay=1.0, max_delay=60.0,
+                 initial_concurrency=INITIAL_CONCURRENCY):
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        # SDK 自带的重试会把 429 藏起来，这里关掉，让并发控制器看到每一个 429
+        self.sdk_client = None
+        # 默认线程池只有 min(32, CPU + 4) 个线程，会悄悄把并发压在上限以下
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def chat(self, model, messages, **params):
+        """ Returns the message content. Raises the last error once retries are exhausted. """
+        key = cache_key(model, messages, **params)
+        cached = get_cache().get(key)
+        if cached is not None:
+            llm_telemetry.count("llm_cache_hits")
+            return cached
+
+        if self.sdk_client is None:
+            self.sdk_client = openai.OpenAI(api_key=openai.api_key, base_url=openai.base_url,
+                                            http_client=openai.http_client, max_retries=0)
+
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimate_tokens(messages, params.get("max_tokens", 512)))
+            # 每次尝试单独占用并发槽位，退避等待期间不占位
+            started = await self.concurrency.acquire()
+            outcome = "error"
+            try:
+                # 排队时间 = 等并发槽位 + 等限流桶，随上下文带进 to_thread 里的实际请求记录
+                llm_telemetry.queue_wait.set(time.monotonic() - queued)
+                llm_telemetry.client_attempt.set(attempt)
+                call = functools.partial(fetch_and_cache, key, model, messages, client=self.sdk_client, **params)
+                content = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, contextvars.copy_context().run, call)
+                outcome = "success"
+                return content
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, OVERLOAD_ERRORS):
+                    outcome = "overload"
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"{type(e).__name__}, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})...")
+            finally:
+                await self.concurrency.release(started, outcome)
+            await asyncio.sleep(delay)  # 不阻塞事件循环
+
+
+_client = None
+
+
+def get_client():
+    """ One client per process, created lazily inside the running event loop. """
+    global _client
+    if _client is None:
+        _client = AsyncLLMClient()
+    return _client
@@ -0,0 +1,365 @@
+"""
+Structural comparison of the code in two answers, as a non-LLM stand-in for the archive keypoint grader
+(two key point extractions + one grading call per row). The answers are mostly Kubernetes YAML and
+kubectl / helm commands, so the code is compared as structure instead of as text:
+
+- fenced (```) and indented markdown code blocks, plus inline `code` spans, are extracted;
+- YAML becomes key paths (spec.template.spec.containers[].image) and path=value pairs;
+- shell blocks become commands (kubectl apply), flags (--namespace) and flag=value pairs;
+- keys, scalar values, arguments and inline spans are also kept as loose terms.
+
+code_similarity is the mean Dice overlap of these feature families, over the families the reference
+has (None when the reference has no code at all).
+
+    python answer_eval.py code-agreement input_data.csv archive/LLM_keypoint_results.csv
+
+YAML is read line by line from its indentation rather than with a YAML parser: Helm templates
+({{ ... }}) and elided manifests ("...") are common in both answers and reject a real parser.
+"""
+import json
+import re
+import shlex
+import textwrap
+import time
+
+import numpy as np
+
+FAMILIES = ("structure", "values", "terms")
+YAML_LANGS = {"yaml", "yml", "helm"}
+SHELL_LANGS = {"bash", "sh", "shell", "console", "zsh", "powershell", "cmd", "terminal"}
+DEFAULT_THRESHOLDS = np.round(np.arange(0, 1.0001, 0.05), 2)
+
+_FENCED = re.compile(r"^[ \t]*```([^\n`]*)\n(.*?)^[ \t]*```", re.DOTALL | re.MULTILINE)
+_INLINE = re.compile(r"`([^`\n]+)`")
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s")
+_YAML_KEY = re.compile(r"""^(?:"([^"]+)"|'([^']+)'|([^\s:#{}\[\],'"][^:#{}\[\],]*?))\s*:(?:\s+(.*)|$)""")
+_TEMPLATE = re.compile(r"\{\{.*?\}\}")
+_BLOCK_SCALAR = re.compile(r"^[|>][-+]?\d*$")
+_SHELL_SEPARATOR = re.compile(r"\s*(?:\|\||&&|\||;)\s*")
+_COMMENT = re.compile(r"\s+#.*$")
+
+
+# ---------------------------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------------------------
+
+def _indented_blocks(text):
+    """ Markdown indented code: a run of lines indented 4+ spaces after a blank line, not inside a list. """
+    runs, current, previous, in_list = [], [], "", False
+    for line in text.split("\n"):
+        indented = line.startswith(("    ", "\t"))
+        if current and (indented or not line.strip()):
+            current.append(line)
+            continue
+        if current:
+            runs.append(current)
+            current = []
+        if indented and not previous.strip() and not in_list:
+            current.append(line)
+        elif line.strip():
+            # 列表项后面缩进的段落是列表的续行，不是代码
+            in_list = bool(_LIST_ITEM.match(line)) or (in_list and line[:1].isspace())
+        previous = line
+    if current:
+        runs.append(current)
+    blocks = [textwrap.dedent("\n".join(run)).strip("\n") for run in runs]
+    return [block for block in blocks if block.strip()]
+
+
+def extract_code(text):
+    """ ([{"lang": ..., "code": ...}] fenced and indented blocks, [inline `code` spans]) of a markdown answer. """
+    text = text or ""
+    blocks = [{"lang": lang.strip().lower(), "code": textwrap.dedent(code)} for lang, code in _FENCED.findall(text)]
+    prose = _FENCED.sub("\n", text)
+    blocks.extend({"lang": "", "code": code} for code in _indented_blocks(prose))
+    return blocks, [span.strip() for span in _INLINE.findall(prose) if span.strip()]
+
+
+# ---------------------------------------------------------------------------------------------
+# Features
+# ---------------------------------------------------------------------------------------------
+
+def _normalize_value(value):
+    value = value.strip()
+    if "{{" in value:
+        value = _TEMPLATE.sub("{{}}", value)
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1]
+    return value.strip().lower()
+
+
+def _looks_like_yaml(code):
+    lines = [line.strip() for line in code.split("\n") if line.strip() and not line.strip().startswith("#")]
+    if not lines:
+        return False
+    mapping = sum(1 for line in lines if _YAML_KEY.match(line.lstrip("- ")) or line.startswith("- "))
+    return mapping * 2 >= len(lines)
+
+
+def yaml_features(code, features):
+    """ Key paths, path=value pairs and terms of a block-style YAML snippet, read from its indentation. """
+    stack = []  # [(indent, path)]
+    scalar_indent = None
+    for raw in code.split("\n"):
+        stripped = raw.strip()
+        indent = len(raw) - len(raw.lstrip(" "))
+        if scalar_indent is not None:
+            # | / > 块标量的正文
+            if not stripped or indent > scalar_indent:
+                continue
+            scalar_indent = None
+        if stripped == "---":
+            stack = []
+            continue
+        if not stripped or stripped.startswith("#") or stripped in ("...", "- ...") \
+                or (stripped.startswith("{{") and stripped.endswith("}}")):
+            continue
+        content = _COMMENT.sub("", stripped) if "#" in stripped else stripped
+
+        item = content == "-" or content.startswith("- ")
+        # "rules:" 下面同缩进的 "- host: ..." 仍属于 rules（常见的紧凑列表写法）
+        while stack and (stack[-1][0] > indent or (stack[-1][0] == indent and (not item or stack[-1][1].endswith("[]")))):
+            stack.pop()
+        while content == "-" or content.startswith("- "):
+            stack.append((indent, (stack[-1][1] if stack else "") + "[]"))
+            rest = content[1:].lstrip()
+            indent += len(content) - len(rest)
+            content = rest
+        if not content:
+            continue
+
+        path = stack[-1][1] if stack else ""
+        match = _YAML_KEY.match(content)
+        if match is None:
+            # 列表里的纯标量，例如 args 里的 "- --port=8080"
+            value = _normalize_value(content)
+            features["values"].add(f"{path}={value}")
+            features["terms"].add(value)
+            continue
+        key = _normalize_value(match.group(1) or match.group(2) or match.group(3))
+        value = match.group(4) or ""
+        key_path = f"{path}.{key}" if path else key
+        features["structure"].add(key_path)
+        features["terms"].add(key)
+        if not value:
+            stack.append((indent, key_path))
+        elif _BLOCK_SCALAR.match(value):
+            scalar_indent = indent
+        else:
+            value = _normalize_value(value)
+            features["values"].add(f"{key_path}={value}")
+            features["terms"].add(value)
+
+
+def _json_features(value, path, features):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            key = str(key).lower()
+            key_path = f"{path}.{key}" if path else key
+            features["structure"].add(key_path)
+            features["terms"].add(key)
+            _json_features(item, key_path, features)
+    elif isinstance(value, list):
+        for item in value:
+            _json_features(item, path + "[]", features)
+    else:
+        value = _normalize_value(json.dumps(value) if not isinstance(value, str) else value)
+        features["values"].add(f"{path}={value}")
+        features["terms"].add(value)
+
+
+def command_features(code, features):
+    """ Commands (program + subcommand), flags and flag=value pairs of a shell snippet. """
+    code = re.sub(r"\\\n", " ", code)
+    for line in code.split("\n"):
+        line = line.strip()
+        if line.startswith(("$ ", "> ")):
+            line = line[2:].strip()
+        if not line or line.startswith("#"):
+            continue
+        for command in _SHELL_SEPARATOR.split(line):
+            if "'" in command or '"' in command or "\\" in command:
+                try:
+                    words = shlex.split(command, comments=True)
+                except ValueError:
+                    words = command.split()
+            else:
+                words = (_COMMENT.sub("", command) if "#" in command else command).split()
+            words = [_normalize_value(word) for word in words if word]
+            if words and words[0] == "sudo":
+                words = words[1:]
+            if not words:
+                continue
+            program = words[0]
+            features["structure"].add(program)
+            subcommand = next((word for word in words[1:] if not word.startswith("-")), None)
+            if subcommand:
+                features["structure"].add(f"{program} {subcommand}")
+            for word in words[1:]:
+                if word.startswith("-"):
+                    flag, _, value = word.partition("=")
+                    features["structure"].add(f"{program} {flag}")
+                    if value:
+                        features["values"].add(f"{program} {flag}={value}")
+                else:
+                    features["terms"].add(word)
+
+
+def code_features(text):
+    """ {family: sorted feature list} of every code block and inline span of a markdown answer. """
+    blocks, spans = extract_code(text)
+    features = {family: set() for family in FAMILIES}
+    for block in blocks:
+        code, lang = block["code"], block["lang"]
+        if lang == "json":
+            try:
+                _json_features(json.loads(code), "", features)
+                continue
+            except ValueError:
+                pass
+        if lang in YAML_LANGS or (lang not in SHELL_LANGS and _looks_like_yaml(code)):
+            yaml_features(code, features)
+        else:
+            command_features(code, features)
+    for span in spans:
+        if " " in span:
+            # `kubectl apply -f ing.yaml` 这样的行内命令
+            command_features(span, features)
+        else:
+            features["terms"].add(_normalize_value(span))
+    return {family: sorted(values) for family, values in features.items()}
+
+
+# ---------------------------------------------------------------------------------------------
+# Scores
+# ---------------------------------------------------------------------------------------------
+
+def dice(reference, response):
+    if not reference and not response:
+        return None
+    return 2 * len(reference & response) / (len(reference) + len(response))
+
+
+def feature_similarity(reference_features, response_features):
+    """ Mean per-family Dice over the families present in the reference; None if it has no code. """
+    scores = [dice(set(reference_features[family]), set(response_features[family]))
+              for family in FAMILIES if reference_features[family]]
+    return float(np.mean(scores)) if scores else None
+
+
+def code_similarity_scores(references, responses, reference_features=None):
+    """ code_similarity per row (None where the reference has no code). """
+    cache = {}
+
+    def features_of(text):
+        # 同一个文件里重复的回答（例如 baseline 的固定回复）只解析一次
+        if text not in cache:
+            cache[text] = code_features(text)
+        return cache[text]
+
+    if reference_features is None:
+        reference_features = [features_of(reference) for reference in references]
+    return [feature_similarity(features, features_of(response))
+            for features, response in zip(reference_features, responses)]
+
+
+def score_records(data, reference_features=None):
+    """ code_similarity_scores for processed entries (reference_answer vs generated_response). """
+    return code_similarity_scores(
+        [item.get("reference_answer") or "" for item in data],
+        [item["generated_response"] for item in data],
+        reference_features,
+    )
+
+
+# ---------------------------------------------------------------------------------------------
+# Agreement with the LLM keypoint grader
+# ---------------------------------------------------------------------------------------------
+
+def _average_ranks(values):
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return ((ends - counts + 1 + ends) / 2)[inverse]
+
+
+def agreement(scores, labels, thresholds=DEFAULT_THRESHOLDS, threshold=None):
+    """
+    How well `scores` (code_similarity) reproduce `labels` (the grader's Y / N): ROC AUC, and accuracy /
+    confusion counts for `threshold` (Y when score >= threshold), or for the best of `thresholds`.
+    Rows with no score (no code in the reference) or no Y / N label are counted but not compared.
+    """
+    labels = [str(label).strip().upper() for label in labels]
+    rows = [i for i, (score, label) in enumerate(zip(scores, labels)) if score is not None and label in ("Y", "N")]
+    report = {
+        "rows": len(labels),
+        "compared": len(rows),
+        "no_reference_code": sum(1 for score in scores if score is None),
+        "no_label": sum(1 for label in labels if label not in ("Y", "N")),
+    }
+    if not rows:
+        return report
+    values = np.asarray([scores[i] for i in rows], dtype=np.float64)
+    truth = np.asarray([labels[i] == "Y" for i in rows])
+    positives, negatives = int(truth.sum()), int((~truth).sum())
+
+    accuracies = [float(np.mean((values >= t) == truth)) for t in thresholds]
+    if threshold is None:
+        threshold = float(thresholds[int(np.argmax(accuracies))])
+    predicted = values >= threshold
+    report.update({
+        "label_y_rate": round(positives / len(rows), 4),
+        # Mann-Whitney U / (P * N)，平分的排名取平均
+        "auc": round(float((_average_ranks(values)[truth].sum() - positives * (positives + 1) / 2)
+                           / (positives * negatives)), 4) if positives and negatives else None,
+        "threshold": threshold,
+        "accuracy": round(float(np.mean(predicted == truth)), 4),
+        "confusion": {
+            "true_y": int((predicted & truth).sum()),
+            "false_y": int((predicted & ~truth).sum()),
+            "true_n": int((~predicted & ~truth).sum()),
+            "false_n": int((~predicted & truth).sum()),
+        },
+        "accuracy_by_threshold": {f"{t:.2f}": round(a, 4) for t, a in zip(thresholds, accuracies)},
+    })
+    return report
+
+
+def compare_with_grader(input_csv, results_csv, output_csv="code_similarity_results.csv", threshold=None):
+    """
+    Scores the archive pipeline's input CSV (Answer Body vs gpt_Generated_Response) and reports the
+    agreement with the Score column of its LLM_keypoint_results.csv. Writes the per-row CSV and
+    `<output>_report.json`; returns the report.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(input_csv)
+    results = pd.read_csv(results_csv)
+    ids = df["Answer ID"].astype(str).tolist()
+    # LLM_keypoint_results.csv 与输入逐行对应；行数或 ID 对不上时按 Answer ID 匹配
+    if ids == results["ID"].astype(str).tolist():
+        labels = results["Score"].tolist()
+    else:
+        by_id = dict(zip(results["ID"].astype(str), results["Score"]))
+        labels = [by_id.get(answer_id) for answer_id in ids]
+
+    started = time.perf_counter()
+    scores = code_similarity_scores([str(text) for text in df["Answer Body"].fillna("")],
+                                    [str(text) for text in df["gpt_Generated_Response"].fillna("")])
+    seconds = time.perf_counter() - started
+    report = agreement(scores, labels, threshold=threshold)
+    report["seconds"] = round(seconds, 3)
+    report["rows_per_second"] = round(len(scores) / seconds, 1) if seconds else None
+
+    cutoff = report.get("threshold")
+    pd.DataFrame({
+        "ID": df["Answer ID"],
+        "Code Similarity": scores,
+        "Code Score": ["N/A" if score is None or cutoff is None else "Y" if score >= cutoff else "N" for score in scores],
+        "Score": labels,
+    }).to_csv(output_csv, index=False)
+    report_filename = output_csv.rsplit(".", 1)[0] + "_report.json"
+    with open(report_filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps({key: value for key, value in report.items() if key != "accuracy_by_threshold"}, indent=4))
+    print(f"Code similarity completed. Results saved to {output_csv}, report to {report_filename}")
+    return report
@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+from array import array
+
+import numpy as np
+
+# 列式缓存目录: <source>.cols/
+#   meta.json                    行数、每列类型、源文件 size/mtime
+#   <col>.f8.npy                 float 列（None -> NaN）
+#   <col>.offsets.npy + .heap    str 列：offsets 索引的 utf-8 字符串堆，<col>.null.npy 标记 None
+#   <col>.rows.npy               str_list 列：每行在 offsets 里的起止位置
+#   <col>.present.npy            只在部分行有这一列时写出：标记哪些行有这个键
+CACHE_SUFFIX = ".cols"
+FORMAT_VERSION = 2
+
+# Column types used when the first value seen is None; otherwise the value type decides
+TEXT_COLUMNS = {"question", "generated_response", "reference_answer"}
+LIST_COLUMNS = {"retrieved_contexts"}
+
+
+def cache_path(filename):
+    return filename + CACHE_SUFFIX
+
+
+def _source_stat(filename):
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _column_kind(name, value):
+    # The value decides; the name only matters when the first value seen is None
+    if isinstance(value, list) or (value is None and name in LIST_COLUMNS):
+        return "str_list"
+    if isinstance(value, str) or (value is None and name in TEXT_COLUMNS):
+        return "str"
+    return "float"
+
+
+class _ColumnWriter:
+    """ Appends one column to disk row by row. """
+
+    def __init__(self, directory, name, kind, n_prev_rows):
+        self.directory = directory
+        self.name = name
+        self.kind = kind
+        self.values = array("d")
+        self.offsets = array("q", [0])
+        self.rows = array("q", [0])
+        self.nulls = bytearray()
+        self.present = bytearray()
+        self.heap = None
+        if kind != "float":
+            self.heap = open(os.path.join(directory, f"{name}.heap"), "wb")
+        # A column that first shows up on a later row is missing for the earlier ones
+        for _ in range(n_prev_rows):
+            self.append_missing()
+
+    def _append_text(self, text):
+        data = text.encode("utf-8")
+        self.heap.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def append_missing(self):
+        self.append(None)
+        self.present[-1] = False
+
+    def append(self, value):
+        self.present.append(True)
+        if self.kind == "float":
+            self.values.append(np.nan if value is None else float(value))
+        elif self.kind == "str":
+            self.nulls.append(value is None)
+            self._append_text("" if value is None else str(value))
+        else:
+            for item in value or []:
+                self._append_text(str(item))
+            self.rows.append(len(self.offsets) - 1)
+
+    def close(self):
+        path = os.path.join(self.directory, self.name)
+        # 缺这一列的行读回时不带这个键，而不是补成 None / []
+        if not all(self.present):
+            np.save(path + ".present.npy", np.frombuffer(bytes(self.present), dtype=np.bool_))
+        if self.kind == "float":
+            np.save(path + ".f8.npy", np.frombuffer(self.values, dtype=np.float64))
+            return
+        self.heap.close()
+        np.save(path + ".offsets.npy", np.frombuffer(self.offsets, dtype=np.int64))
+        if self.kind == "str":
+            np.save(path + ".null.npy", np.frombuffer(bytes(self.nulls), dtype=np.bool_))
+        else:
+            np.save(path + ".rows.npy", np.frombuffer(self.rows, dtype=np.int64))
+
+
+def write_columnar(records, source_filename, output_path=None):
+    """ Streams records (processed or score entries) into a columnar cache next to `source_filename`. """
+    output_path = output_path or cache_path(source_filename)
+    tmp_path = output_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    writers = {}
+    n_rows = 0
+    for record in records:
+        for name, value in record.items():
+            if name not in writers:
+                writers[name] = _ColumnWriter(tmp_path, name, _column_kind(name, value), n_rows)
+        for name, writer in writers.items():
+            if name in record:
+                writer.append(record[name])
+            else:
+                writer.append_missing()
+        n_rows += 1
+
+    for writer in writers.values():
+        writer.close()
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "n_rows": n_rows,
+        "columns": {name: writer.kind for name, writer in writers.items()},
+        "source": _source_stat(source_filename),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=4)
+
+    # 整个目录写完再替换，读者不会看到半成品
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def is_fresh(source_filename, path=None):
+    """ True if a cache exists and was built from the current version of `source_filename`. """
+    path = path or cache_path(source_filename)
+    meta_filename = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_filename) or not os.path.exists(source_filename):
+        return False
+    with open(meta_filename, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta.get("version") == FORMAT_VERSION and meta.get("source") == _source_stat(source_filename)
+
+
+class StringColumn:
+    """ Lazy view over a memory-mapped string heap, decodes a row only when it is accessed. """
+
+    def __init__(self, heap, offsets, nulls):
+        self.heap = heap
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        return bytes(self.heap[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+class StringListColumn:
+    """ Lazy view over a list-of-strings column (e.g. retrieved_contexts). """
+
+    def __init__(self, heap, offsets, rows):
+        self.heap = heap
+        self.offsets = offsets
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows) - 1
+
+    def __getitem__(self, i):
+        start, end = self.rows[i], self.rows[i + 1]
+        return [bytes(self.heap[self.offsets[j]:self.offsets[j + 1]]).decode("utf-8") for j in range(start, end)]
+
+
+class ColumnarDataset:
+    """ Memory-mapped reader. Only the columns that are asked for are ever touched on disk. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.n_rows = self.meta["n_rows"]
+        self.columns = self.meta["columns"]
+
+    def __len__(self):
+        return self.n_rows
+
+    def _load(self, suffix):
+        return np.load(os.path.join(self.path, suffix), mmap_mode="r")
+
+    def _heap(self, name):
+        heap_filename = os.path.join(self.path, f"{name}.heap")
+        # np.memmap 不支持空文件
+        if os.path.getsize(heap_filename) == 0:
+            return b""
+        return np.memmap(heap_filename, dtype=np.uint8, mode="r")
+
+    def column(self, name):
+        kind = self.columns[name]
+        if kind == "float":
+            return self._load(f"{name}.f8.npy")
+        offsets = self._load(f"{name}.offsets.npy")
+        if kind == "str":
+            return StringColumn(self._heap(name), offsets, self._load(f"{name}.null.npy"))
+        return StringListColumn(self._heap(name), offsets, self._load(f"{name}.rows.npy"))
+
+    def present(self, name):
+        """ Boolean mask of the rows that have column `name`, or None when every row has it. """
+        filename = os.path.join(self.path, f"{name}.present.npy")
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename, mmap_mode="r")
+
+    def floats(self, name, limit=None, start=0):
+        """ A float column as a NumPy array (NaN for missing values). """
+        values = self.column(name)
+        return np.asarray(values[start:None if limit is None else start + limit])
+
+    def iter_records(self, columns=None, limit=None, start=0):
+        columns = [c for c in (columns or self.columns) if c in self.columns]
+        views = {name: self.column(name) for name in columns}
+        present = {name: self.present(name) for name in columns}
+        stop = self.n_rows if limit is None else min(start + limit, self.n_rows)
+        for i in range(start, stop):
+            record = {}
+            for name, view in views.items():
+                if present[name] is not None and not present[name][i]:
+                    continue
+                value = view[i]
+                if self.columns[name] == "float":
+                    value = None if np.isnan(value) else float(value)
+                record[name] = value
+            yield record
+
+
+def open_cache(source_filename):
+    """ Returns a ColumnarDataset if a fresh cache exists for `source_filename`, else None. """
+    if is_fresh(source_filename):
+        return ColumnarDataset(cache_path(source_filename))
+    return None
@@ -0,0 +1,214 @@
+"""
+Token-budgeted context packing before RAGAS scoring.
+
+Retrieved contexts are deduplicated (identical contexts, and paragraphs already present in a
+higher-ranked context) and then packed in retrieval order up to `budget` tokens per sample;
+the context that crosses the budget is truncated at a token boundary.
+
+Tokens are counted with tiktoken (cl100k_base) when it is installed, otherwise with a
+regex word / punctuation split of about the same granularity.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+from data_io import iter_records, write_jsonl
+
+DEFAULT_BUDGET = 1024
+# 短段落（空行、``` 、单个 key: value）在文档里经常重复，去重没有意义
+MIN_DEDUP_CHARS = 40
+# A truncated tail shorter than this is dropped instead of kept
+MIN_TAIL_TOKENS = 32
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """ Longest prefix of `text` with at most `max_tokens` tokens. """
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    for i, match in enumerate(_TOKEN_PATTERN.finditer(text)):
+        if i == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def _normalize(text):
+    return " ".join(text.split()).lower()
+
+
+def dedup_contexts(contexts):
+    """
+    Drops repeated contexts and, inside each context, paragraphs already seen in an earlier one
+    (overlapping chunks of the same document). Returns (contexts, paragraphs dropped).
+    """
+    seen_contexts = set()
+    seen_paragraphs = set()
+    kept = []
+    dropped = 0
+    for context in contexts:
+        key = _normalize(context)
+        if not key or key in seen_contexts:
+            dropped += 1
+            continue
+        seen_contexts.add(key)
+
+        paragraphs = []
+        for paragraph in _PARAGRAPH_SPLIT.split(context):
+            key = _normalize(paragraph)
+            if len(key) >= MIN_DEDUP_CHARS:
+                if key in seen_paragraphs:
+                    dropped += 1
+                    continue
+                seen_paragraphs.add(key)
+            paragraphs.append(paragraph)
+        text = "\n\n".join(paragraphs).strip()
+        if text:
+            kept.append(text)
+    return kept, dropped
+
+
+def pack_contexts(contexts, budget=DEFAULT_BUDGET):
+    """ Deduplicated contexts packed in retrieval order into at most `budget` tokens, plus per-sample stats. """
+    tokens_before = sum(count_tokens(context) for context in contexts)
+    deduped, dropped = dedup_contexts(contexts)
+
+    packed = []
+    remaining = budget
+    truncated = False
+    for context in deduped:
+        tokens = count_tokens(context)
+        if tokens <= remaining:
+            packed.append(context)
+            remaining -= tokens
+            continue
+        truncated = True
+        if remaining >= MIN_TAIL_TOKENS:
+            packed.append(truncate_tokens(context, remaining))
+        break
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": sum(count_tokens(context) for context in packed),
+        "contexts_before": len(contexts),
+        "contexts_after": len(packed),
+        "duplicates_dropped": dropped,
+        "truncated": truncated,
+    }
+    return packed, stats
+
+
+def pack_record(record, budget=DEFAULT_BUDGET):
+    """ Copy of a processed entry with packed `retrieved_contexts` (context_ids no longer apply). """
+    packed, stats = pack_contexts(record.get("retrieved_contexts") or [], budget)
+    record = {key: value for key, value in record.items() if key != "context_ids"}
+    record["retrieved_contexts"] = packed
+    return record, stats
+
+
+def _percentiles(values):
+    if not len(values):
+        return None
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def packing_report(stats, budget):
+    """ Totals and per-sample distribution of context tokens before / after packing. """
+    before = np.asarray([s["tokens_before"] for s in stats], dtype=np.float64)
+    after = np.asarray([s["tokens_after"] for s in stats], dtype=np.float64)
+    total_before, total_after = int(before.sum()), int(after.sum())
+    return {
+        "budget": budget,
+        "tokenizer": "tiktoken cl100k_base" if _get_encoding() else "regex",
+        "samples": len(stats),
+        "samples_truncated": sum(s["truncated"] for s in stats),
+        "duplicates_dropped": sum(s["duplicates_dropped"] for s in stats),
+        "contexts_before": sum(s["contexts_before"] for s in stats),
+        "contexts_after": sum(s["contexts_after"] for s in stats),
+        "tokens_before": total_before,
+        "tokens_after": total_after,
+        "token_reduction": round(1 - total_after / total_before, 4) if total_before else 0.0,
+        "tokens_per_sample_before": _percentiles(before),
+        "tokens_per_sample_after": _percentiles(after),
+    }
+
+
+def pack_records(data, budget=DEFAULT_BUDGET):
+    """ Packs a list of entries in memory; returns (packed entries, report). """
+    packed, stats = [], []
+    for record in data:
+        record, record_stats = pack_record(record, budget)
+        packed.append(record)
+        stats.append(record_stats)
+    return packed, packing_report(stats, budget)
+
+
+def report_filename(output_filename):
+    return output_filename + ".packing.json"
+
+
+def write_report(report, output_filename):
+    filename = report_filename(output_filename)
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Context packing: {report['tokens_before']} -> {report['tokens_after']} tokens "
+          f"({report['token_reduction']:.1%} less, budget {report['budget']}/sample). Report saved to {filename}")
+    return filename
+
+
+def merge_reports(filenames, output_filename):
+    """
+    Combines the packing reports of several shards into `<output>.packing.json`, recomputed from their
+    per-row `packed_contexts` entries. Missing files (empty shards) are skipped.
+    """
+    reports = []
+    for filename in filenames:
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as f:
+                reports.append(json.load(f))
+    if not reports:
+        return None
+    samples = [sample for report in reports for sample in report["packed_contexts"]]
+    report = packing_report(samples, reports[0]["budget"])
+    report["packed_contexts"] = samples
+    return write_report(report, output_filename)
+
+
+def pack_file(json_filename, output_filename, budget=DEFAULT_BUDGET, limit=None):
+    """ Streams a processed file into a packed .jsonl file that 02 / 03 can score directly. """
+    stats = []
+
+    def packed_records():
+        for record in iter_records(json_filename, limit=limit):
+            record, record_stats = pack_record(record, budget)
+            stats.append(record_stats)
+            yield record
+
+    write_jsonl(packed_records(), output_filename)
+    report = packing_report(stats, budget)
+    write_report(report, output_filename)
+    return report
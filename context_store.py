@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+# 每个 corpus 一份：同一个 context chunk（按 gpt_Context_IDs）只存一次
+CONTEXT_STORE_FILENAME = "context_store.jsonl"
+
+
+def normalize_context_id(context_id):
+    """ "345.0" -> "345", the CSV exports write IDs as floats. """
+    context_id = str(context_id).strip()
+    if context_id.endswith(".0"):
+        context_id = context_id[:-2]
+    return context_id
+
+
+def parse_context_ids(value):
+    """ Splits a gpt_Context_IDs cell ("345.0, 3389.0, 341.0") into normalized IDs. """
+    return [normalize_context_id(i) for i in value.split(",") if i.strip()]
+
+
+def _text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ContextStore:
+    """
+    Append-only JSONL store of context chunks keyed by context ID.
+    Only byte offsets are kept in memory; a chunk's text is read from disk the first time it is resolved.
+    """
+
+    def __init__(self, filename=CONTEXT_STORE_FILENAME):
+        self.filename = filename
+        self.index = {}  # id -> (offset, length, sha1)
+        if os.path.exists(filename):
+            with open(filename, "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self.index[item["id"]] = (offset, len(line), item["sha1"])
+                    offset += len(line)
+        self._read = lru_cache(maxsize=4096)(self._read_uncached)
+
+    def __contains__(self, context_id):
+        return normalize_context_id(context_id) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, context_id, text):
+        """ Stores `text` under `context_id` once and returns the key to reference it by. """
+        context_id = normalize_context_id(context_id)
+        sha1 = _text_hash(text)
+        if context_id in self.index and self.index[context_id][2] != sha1:
+            # 同一个 ID 在另一个知识库 / 切分版本里是不同的文本：用内容哈希区分
+            context_id = f"{context_id}@{sha1[:10]}"
+        if context_id in self.index:
+            return context_id
+
+        line = (json.dumps({"id": context_id, "sha1": sha1, "text": text}, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.filename, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+        self.index[context_id] = (offset, len(line), sha1)
+        return context_id
+
+    def _read_uncached(self, context_id):
+        offset, length, _ = self.index[context_id]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))["text"]
+
+    def get(self, context_id):
+        return self._read(normalize_context_id(context_id))
+
+    def resolve(self, context_ids):
+        return [self.get(context_id) for context_id in context_ids]
+
+
+_default_stores = {}
+
+
+def get_store(filename=CONTEXT_STORE_FILENAME):
+    """ One shared store per file within a process. """
+    if filename not in _default_stores:
+        _default_stores[filename] = ContextStore(filename)
+    return _default_stores[filename]
+
+
+def resolve_record(record, store=None):
+    """ Fills `retrieved_contexts` of a record that only references contexts by ID. """
+    if "context_ids" in record and "retrieved_contexts" not in record:
+        store = store or get_store()
+        record["retrieved_contexts"] = store.resolve(record["context_ids"])
+    return record
+
+
+def context_reference(record):
+    """ The context field to copy into a score entry: IDs into the store if the input used them, else the texts. """
+    if "context_ids" in record:
+        return {"context_ids": record["context_ids"]}
+    return {"retrieved_contexts": record["retrieved_contexts"]}
@@ -0,0 +1,183 @@
+import json
+import os
+from itertools import islice
+
+from context_store import resolve_record
+from record_index import iter_range, save_index
+
+
+def _open_columnar(filename):
+    """ Returns the memory-mapped columnar cache of `filename` if one is built and fresh, else None. """
+    # 只有缓存目录存在时才 import numpy，纯 JSON 路径不依赖它
+    if not os.path.isdir(filename + ".cols"):
+        return None
+    from columnar_cache import open_cache
+    return open_cache(filename)
+
+
+def _iter_json(filename):
+    if filename.endswith(".jsonl"):
+        # JSONL: one JSON object per line, never holds the whole file in memory
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        # 旧格式：整个文件是一个 JSON list
+        with open(filename, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+def iter_records(filename, limit=None, columns=None, start=0, resolve=True):
+    """
+    Yields processed / scored records one by one, from the columnar cache, a .jsonl file or a legacy .json list.
+    `start` / `limit` select a row range; ranges other than a plain JSONL prefix go through the offset index,
+    so only the selected rows are parsed. `resolve=False` leaves records that reference contexts by ID as they are.
+    """
+    dataset = _open_columnar(filename)
+    if dataset is not None:
+        records = dataset.iter_records(columns=columns, limit=limit, start=start)
+    elif start == 0 and (limit is None or filename.endswith(".jsonl")):
+        records = islice(_iter_json(filename), limit)
+    else:
+        records = iter_range(filename, start, None if limit is None else start + limit)
+
+    if not resolve:
+        yield from records
+        return
+    # Records that reference contexts by ID get their texts from the context store, one record at a time
+    for record in records:
+        yield resolve_record(record)
+
+
+def load_records(filename, limit=None, columns=None, start=0, resolve=True):
+    """ Loads records into a list. With `limit`, a .jsonl file stops reading after `limit` rows. """
+    return list(iter_records(filename, limit=limit, columns=columns, start=start, resolve=resolve))
+
+
+def load_columns(filename, columns, limit=None, start=0):
+    """ Returns {column: values} for just `columns`. With a columnar cache, float columns come straight from the mmap. """
+    dataset = _open_columnar(filename)
+    if dataset is not None:
+        stop = len(dataset) if limit is None else min(start + limit, len(dataset))
+        result = {}
+        for name in columns:
+            kind = dataset.columns.get(name)
+            if kind is None:
+                result[name] = []
+                continue
+            # 和 JSON 路径一样，只取有这一列的行
+            present = dataset.present(name)
+            if kind == "float":
+                values = dataset.floats(name, limit, start)
+                result[name] = values if present is None else values[present[start:stop]]
+            else:
+                view = dataset.column(name)
+                result[name] = [view[i] for i in range(start, stop) if present is None or present[i]]
+        return result
+
+    result = {name: [] for name in columns}
+    # 只有要 retrieved_contexts 时才去 context store 取全文
+    for record in iter_records(filename, limit=limit, start=start, resolve="retrieved_contexts" in columns):
+        for name in columns:
+            if name in record:
+                result[name].append(record[name])
+    return result
+
+
+# 评分时写在分数文件旁边的旁路文件（崩溃后留下的 journal 等），不是分数文件
+SIDE_FILE_SUFFIXES = (".journal.jsonl", ".telemetry.json", ".packing.json")
+
+
+def is_score_file(name):
+    """ True for .json / .jsonl result files; offset indexes (.idx) and other side files are skipped. """
+    return name.endswith((".json", ".jsonl")) and not name.endswith(SIDE_FILE_SUFFIXES)
+
+
+def write_jsonl(records, filename, index=True):
+    """
+    Writes records one per line as they are produced, returns the number of lines written.
+    Lines go to `<filename>.tmp`, which replaces `filename` only once every record has been written.
+    """
+    spans = []
+    offset = 0
+    # 生成记录时出错（例如 CSV 缺列）不会留下空的或写了一半的输出文件
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(tmp_filename, "wb") as f:
+            for record in records:
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                spans.append((offset, offset + len(line)))
+                offset += len(line)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+    # 顺手写出 offset 索引，之后按行号随机读取不用再扫描
+    if index:
+        save_index(filename, spans)
+    return len(spans)
+
+
+ID_FIELDS = ("question_id", "answer_id")
+# Texts copied from the processed entry into every score entry; --metrics-only drops them
+TEXT_FIELDS = ("question", "retrieved_contexts", "context_ids", "generated_response", "reference_answer")
+
+
+def id_fields(item):
+    """ Question ID / Answer ID of a processed entry (absent in files processed before IDs were added). """
+    return {key: item[key] for key in ID_FIELDS if key in item}
+
+
+def metrics_only(entry, row):
+    """ A score entry reduced to its input row, IDs and metric values. """
+    return {"row": row, **{key: value for key, value in entry.items() if key not in TEXT_FIELDS}}
+
+
+class ResultWriter:
+    """
+    Writes score entries in input order as batches finish. A .jsonl output gets one compact line per
+    entry, flushed after every batch: nothing is held in memory and a running stage's results can
+    already be read. Any other filename gets the legacy indented JSON list when the writer is closed.
+    With `metrics_only`, entries keep only their row (counted from `start`), IDs and metrics.
+    """
+
+    def __init__(self, filename, metrics_only=False, start=0):
+        self.filename = filename
+        self.metrics_only = metrics_only
+        self.row = start
+        self.count = 0
+        self.streaming = filename.endswith(".jsonl")
+        self.entries = []
+        self.file = open(filename, "w", encoding="utf-8") if self.streaming else None
+
+    def write(self, entries):
+        for entry in entries:
+            if self.metrics_only:
+                entry = metrics_only(entry, self.row)
+            if self.streaming:
+                self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            else:
+                self.entries.append(entry)
+            self.row += 1
+            self.count += 1
+        if self.streaming:
+            self.file.flush()
+
+    def close(self):
+        if self.streaming:
+            self.file.close()
+        else:
+            with open(self.filename, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=4, ensure_ascii=False)
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # 出错时也关闭文件，已经写出的行保留
+        if self.streaming or exc[0] is None:
+            self.close()
@@ -0,0 +1,262 @@
+"""
+Per-call telemetry for every OpenAI chat / embedding request made in a stage, whoever makes it
+(ragas / langchain, the archive scripts' shared client, the embedding engine).
+
+    telemetry = llm_telemetry.start("02_ragas_score")
+    ...                                   # run the stage
+    telemetry.write(output_filename)      # -> <output>.telemetry.json
+
+Each call records wall time, queue wait (time spent waiting for a slot in archive/llm_client),
+prompt / completion tokens, retries and error class; the JSON has totals and p50 / p95 / p99,
+plus the raw call records so that the files of several shards can be merged (`merge`).
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Set by archive/llm_client around each dispatched request (copied into the to_thread worker)
+queue_wait = contextvars.ContextVar("queue_wait", default=0.0)
+client_attempt = contextvars.ContextVar("client_attempt", default=0)
+# SDK-internal retries of the call currently running in this context
+_sdk_retries = contextvars.ContextVar("sdk_retries", default=None)
+
+PERCENTILES = (50, 95, 99)
+
+
+def telemetry_filename(output_filename):
+    return output_filename + ".telemetry.json"
+
+
+def _distribution(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+    summary["mean"] = round(float(values.mean()), 4)
+    summary["max"] = round(float(values.max()), 4)
+    return summary
+
+
+class Telemetry:
+    """ Call records of one stage; safe to record into from worker threads. """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = time.time()
+        self.calls = []
+        self.counters = {}
+        self.series = {}
+        self.elapsed = None  # 合并分片时取各分片的最大值，否则按 started 计算
+        self.lock = threading.Lock()
+
+    def record(self, **call):
+        with self.lock:
+            self.calls.append(call)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sample(self, name, value):
+        """ Adds (seconds since start, value) to a time series, e.g. the adaptive concurrency limit. """
+        with self.lock:
+            self.series.setdefault(name, []).append((round(time.time() - self.started, 3), value))
+
+    def _kind_summary(self, calls):
+        errors = {}
+        for call in calls:
+            if call["error"]:
+                errors[call["error"]] = errors.get(call["error"], 0) + 1
+        return {
+            "calls": len(calls),
+            "errors": errors,
+            "totals": {
+                "wall_seconds": round(sum(c["wall"] for c in calls), 3),
+                "queue_wait_seconds": round(sum(c["queue_wait"] for c in calls), 3),
+                "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+                "completion_tokens": sum(c["completion_tokens"] for c in calls),
+                # SDK 内部重试 + 共享客户端的重试（attempt > 0 的调用）
+                "retries": sum(c["retries"] for c in calls) + sum(1 for c in calls if c["attempt"] > 0),
+            },
+            "histograms": {
+                "wall_seconds": _distribution([c["wall"] for c in calls]),
+                "queue_wait_seconds": _distribution([c["queue_wait"] for c in calls]),
+                "prompt_tokens": _distribution([c["prompt_tokens"] for c in calls if not c["error"]]),
+                "completion_tokens": _distribution([c["completion_tokens"] for c in calls if not c["error"]]),
+            },
+            "models": sorted({c["model"] for c in calls if c["model"]}),
+        }
+
+    def summary(self):
+        with self.lock:
+            calls = list(self.calls)
+            counters = dict(self.counters)
+            series = {name: list(values) for name, values in self.series.items()}
+        elapsed = self.elapsed if self.elapsed is not None else time.time() - self.started
+        return {
+            "stage": self.stage,
+            "elapsed_seconds": round(elapsed, 3),
+            "counters": counters,
+            **{kind: self._kind_summary([c for c in calls if c["kind"] == kind]) for kind in ("chat", "embedding")},
+            "series": series,
+            "call_records": calls,
+        }
+
+    def write(self, output_filename):
+        filename = telemetry_filename(output_filename)
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=4)
+        print(f"Telemetry saved to {filename}")
+        return filename
+
+
+def merge(filenames, output_filename):
+    """
+    Combines the telemetry files of several shards into `<output>.telemetry.json`: counters and totals are
+    summed, distributions are recomputed over all shards' calls. Missing files (empty shards) are skipped.
+    """
+    summaries = []
+    for filename in filenames:
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as f:
+                summaries.append(json.load(f))
+    if not summaries:
+        return None
+
+    merged = Telemetry(summaries[0]["stage"])
+    # 分片并行运行，总耗时取最慢的分片
+    merged.elapsed = max(summary["elapsed_seconds"] for summary in summaries)
+    for summary in summaries:
+        merged.calls.extend(summary.get("call_records", []))
+        for name, amount in summary["counters"].items():
+            merged.count(name, amount)
+        for name, values in summary["series"].items():
+            merged.series.setdefault(name, []).extend(values)
+    return merged.write(output_filename)
+
+
+_active = None
+
+
+def active():
+    return _active
+
+
+def start(stage):
+    """ Starts recording for `stage` (replacing any earlier stage in this process). """
+    global _active
+    install()
+    _active = Telemetry(stage)
+    return _active
+
+
+def count(name, amount=1):
+    if _active is not None:
+        _active.count(name, amount)
+
+
+def sample(name, value):
+    if _active is not None:
+        _active.sample(name, value)
+
+
+def _record(kind, kwargs, started, response, error, retries):
+    if _active is None:
+        return
+    usage = getattr(response, "usage", None)
+    _active.record(
+        kind=kind,
+        model=kwargs.get("model"),
+        wall=time.perf_counter() - started,
+        queue_wait=queue_wait.get(),
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        retries=retries,
+        attempt=client_attempt.get(),
+        error=error,
+    )
+
+
+def _wrap_sync(kind, create):
+    @functools.wraps(create)
+    def wrapper(self, *args, **kwargs):
+        retries = [0]
+        token = _sdk_retries.set(retries)
+        started = time.perf_counter()
+        response, error = None, None
+        try:
+            response = create(self, *args, **kwargs)
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _sdk_retries.reset(token)
+            _record(kind, kwargs, started, response, error, retries[0])
+    return wrapper
+
+
+def _wrap_async(kind, create):
+    @functools.wraps(create)
+    async def wrapper(self, *args, **kwargs):
+        retries = [0]
+        token = _sdk_retries.set(retries)
+        started = time.perf_counter()
+        response, error = None, None
+        try:
+            response = await create(self, *args, **kwargs)
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _sdk_retries.reset(token)
+            _record(kind, kwargs, started, response, error, retries[0])
+    return wrapper
+
+
+def _wrap_sleep_for_retry(sleep):
+    def bump():
+        retries = _sdk_retries.get()
+        if retries is not None:
+            retries[0] += 1
+
+    if asyncio.iscoroutinefunction(sleep):
+        @functools.wraps(sleep)
+        async def async_wrapper(self, *args, **kwargs):
+            bump()
+            return await sleep(self, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(sleep)
+    def wrapper(self, *args, **kwargs):
+        bump()
+        return sleep(self, *args, **kwargs)
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """ Patches the openai SDK once per process; calls are recorded only while a stage is active. """
+    global _installed
+    if _installed:
+        return
+    import openai._base_client as base_client
+    from openai.resources.chat.completions import AsyncCompletions, Completions
+    from openai.resources.embeddings import AsyncEmbeddings, Embeddings
+
+    Completions.create = _wrap_sync("chat", Completions.create)
+    AsyncCompletions.create = _wrap_async("chat", AsyncCompletions.create)
+    Embeddings.create = _wrap_sync("embedding", Embeddings.create)
+    AsyncEmbeddings.create = _wrap_async("embedding", AsyncEmbeddings.create)
+    for client_class in (base_client.SyncAPIClient, base_client.AsyncAPIClient):
+        client_class._sleep_for_retry = _wrap_sleep_for_retry(client_class._sleep_for_retry)
+    _installed = True
@@ -0,0 +1,254 @@
+"""
+Local stand-in for the OpenAI API (chat completions + embeddings), for offline tests and load tests.
+
+    python mock_openai_server.py --port 8089 --latency 0.5 --jitter 0.2 --error-rate 0.01 --rate-limit-rate 0.05
+    export OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock NO_PROXY=127.0.0.1,localhost
+
+Outputs are deterministic: the same request (and --seed) always gets the same reply and the same
+embedding. Replies come from --responses (a JSON list of {"match": substring, "response": text},
+first match wins) or a built-in generator that understands the keypoint / grading prompts.
+Embeddings are hashed bag-of-words vectors, so similar texts get similar vectors.
+
+Failure injection: --error-rate returns 500s, --rate-limit-rate returns 429s, and --rpm / --max-concurrency
+answer 429 once a real requests-per-minute or in-flight limit is exceeded, like a provider would.
+GET /stats returns the request, error and concurrency counters.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    return len(_TOKEN_PATTERN.findall(text or ""))
+
+
+def request_seed(seed, *parts):
+    payload = json.dumps([seed, *parts], sort_keys=True, ensure_ascii=False)
+    return int(hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def hashed_embedding(text, dim):
+    """ Signed feature hashing of lowercase word tokens, L2-normalized. """
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()):
+        h = int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+        vector[h % dim] += 1.0 if h & (1 << 31) else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def generated_reply(prompt, rng):
+    """ Built-in replies shaped like what the pipeline's prompts ask for. """
+    if "<evaluation>" in prompt or "<accuracy_score>" in prompt:
+        score = rng.randint(0, 100)
+        return f"<accuracy_score>{score}</accuracy_score>\n<reasoning>mock grade {score}</reasoning>"
+    if "Key Points" in prompt or "key point" in prompt.lower():
+        return "### **Key Points:**\n" + "\n".join(f"{i}. mock key point {rng.randint(0, 9999)}" for i in range(1, 4))
+    words = re.findall(r"\w+", prompt)[-50:]
+    rng.shuffle(words)
+    return "Mock answer: " + " ".join(words[:20])
+
+
+class MockState:
+    """ Configuration and counters shared by all handler threads. """
+
+    def __init__(self, args):
+        self.args = args
+        self.responses = []
+        if args.responses:
+            with open(args.responses, "r", encoding="utf-8") as f:
+                self.responses = json.load(f)
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        self.recent = deque()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "max_in_flight": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    def admit(self):
+        """ None if the request may proceed, else (status, message) of the injected failure. """
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            # 故障注入用独立的随机序列，和回复内容的确定性无关
+            roll = self.rng.random()
+            if self.args.rpm and len(self.recent) >= self.args.rpm:
+                failure = (429, "Rate limit reached for requests per minute")
+            elif self.args.max_concurrency and self.in_flight >= self.args.max_concurrency:
+                failure = (429, "Too many concurrent requests")
+            elif roll < self.args.rate_limit_rate:
+                failure = (429, "Rate limit reached (injected)")
+            elif roll < self.args.rate_limit_rate + self.args.error_rate:
+                failure = (500, "The server had an error while processing your request (injected)")
+            else:
+                failure = None
+            if failure is None:
+                self.recent.append(now)
+                self.in_flight += 1
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            else:
+                self.stats["rate_limited" if failure[0] == 429 else "errors"] += 1
+            return failure
+
+    def release(self, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.in_flight -= 1
+            self.stats["ok"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+
+    def latency(self):
+        with self.lock:
+            jitter = self.rng.uniform(-self.args.jitter, self.args.jitter) if self.args.jitter else 0.0
+        return max(0.0, self.args.latency + jitter)
+
+    def reply(self, prompt, rng):
+        for canned in self.responses:
+            if canned["match"] in prompt:
+                return canned["response"]
+        return generated_reply(prompt, rng)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message):
+        error_type = {429: "rate_limit_exceeded", 500: "server_error"}.get(status, "invalid_request_error")
+        headers = {"retry-after-ms": str(int(self.state.args.retry_after * 1000))} if status == 429 else None
+        self._send(status, {"error": {"message": message, "type": error_type, "code": error_type}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.state.lock:
+                return self._send(200, dict(self.state.stats, in_flight=self.state.in_flight))
+        if self.path.rstrip("/") == "/v1/models":
+            return self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        self._error(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return self._error(400, "Request body is not valid JSON")
+
+        path = self.path.rstrip("/")
+        if path not in ("/v1/chat/completions", "/v1/embeddings"):
+            return self._error(404, f"Unknown path {self.path}")
+        if body.get("stream"):
+            return self._error(400, "Streaming is not supported by the mock server")
+
+        failure = self.state.admit()
+        if failure:
+            return self._error(*failure)
+        prompt_tokens = completion_tokens = 0
+        try:
+            time.sleep(self.state.latency())
+            if path == "/v1/chat/completions":
+                response, prompt_tokens, completion_tokens = self._chat(body)
+            else:
+                response, prompt_tokens = self._embeddings(body)
+        finally:
+            self.state.release(prompt_tokens, completion_tokens)
+        self._send(200, response)
+
+    def _chat(self, body):
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(m.get("content") or "") for m in messages)
+        choices = []
+        for index in range(body.get("n") or 1):
+            rng = random.Random(request_seed(self.state.args.seed, body.get("model"), messages, index))
+            content = self.state.reply(prompt, rng)
+            choices.append({"index": index, "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop", "logprobs": None})
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = sum(count_tokens(c["message"]["content"]) for c in choices)
+        return {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "mock",
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, prompt_tokens, completion_tokens
+
+    def _embeddings(self, body):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        dim = body.get("dimensions") or self.state.args.dim
+        data = [{"object": "embedding", "index": i, "embedding": hashed_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)]
+        prompt_tokens = sum(count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "model": body.get("model") or "mock",
+            "data": data,
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }, prompt_tokens
+
+
+def build_server(args):
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Deterministic local OpenAI-compatible server for offline testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every successful request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=0, help="429 once more than this many requests in 60s (0 = off)")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 above this many in-flight requests (0 = off)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="seconds advertised in 429 retry-after-ms")
+    parser.add_argument("--dim", type=int, default=1536, help="embedding dimensions")
+    parser.add_argument("--responses", help="JSON list of {\"match\": substring, \"response\": text} canned replies")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    server = build_server(args)
+    print(f"Mock OpenAI server on http://{args.host}:{server.server_address[1]}/v1 "
+          f"(latency {args.latency}s±{args.jitter}, errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,105 @@
+import json
+import os
+from array import array
+
+# Sidecar offset index: <file>.idx
+#   int64 header: [version, source size, source mtime_ns, n_records]
+#   int64 body:   start, end byte offset of every record
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+
+def index_path(filename):
+    return filename + INDEX_SUFFIX
+
+
+def _header(filename, n_records):
+    stat = os.stat(filename)
+    return [INDEX_VERSION, stat.st_size, stat.st_mtime_ns, n_records]
+
+
+def save_index(filename, spans):
+    """ Writes the (start, end) byte span of every record next to `filename`. """
+    data = array("q", _header(filename, len(spans)))
+    for start, end in spans:
+        data.append(start)
+        data.append(end)
+    tmp_filename = index_path(filename) + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        data.tofile(f)
+    os.replace(tmp_filename, index_path(filename))
+
+
+def _scan_jsonl(filename):
+    """ Record spans of a JSONL file, found from line breaks only (nothing is parsed). """
+    spans = []
+    offset = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            if line.strip():
+                spans.append((offset, offset + len(line)))
+            offset += len(line)
+    return spans
+
+
+def _scan_json_list(filename):
+    """ Record spans of a JSON list file. The file is parsed once here; later reads only parse what they need. """
+    with open(filename, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    decoder = json.JSONDecoder()
+    spans = []
+    # 字符位置 -> 字节位置（ensure_ascii=False 时两者不同），逐段累加保持线性
+    char_pos, byte_pos = 0, 0
+
+    def to_bytes(pos):
+        nonlocal char_pos, byte_pos
+        byte_pos += len(text[char_pos:pos].encode("utf-8"))
+        char_pos = pos
+        return byte_pos
+
+    pos = text.index("[") + 1
+    while True:
+        while text[pos] in " \t\r\n,":
+            pos += 1
+        if text[pos] == "]":
+            break
+        _, end = decoder.raw_decode(text, pos)
+        spans.append((to_bytes(pos), to_bytes(end)))
+        pos = end
+    return spans
+
+
+def build_index(filename):
+    spans = _scan_jsonl(filename) if filename.endswith(".jsonl") else _scan_json_list(filename)
+    save_index(filename, spans)
+    return spans
+
+
+def load_index(filename):
+    """ Returns the record spans of `filename`, building the sidecar on first use or when the file changed. """
+    path = index_path(filename)
+    if os.path.exists(path):
+        data = array("q")
+        with open(path, "rb") as f:
+            data.frombytes(f.read())
+        if len(data) >= 4 and list(data[:3]) == _header(filename, 0)[:3] and len(data) == 4 + 2 * data[3]:
+            return list(zip(data[4::2], data[5::2]))
+    return build_index(filename)
+
+
+def count_records(filename):
+    return len(load_index(filename))
+
+
+def iter_range(filename, start=0, stop=None):
+    """ Yields records start..stop-1 by seeking to their byte spans, without parsing the rest of the file. """
+    spans = load_index(filename)[start:stop]
+    with open(filename, "rb") as f:
+        for begin, end in spans:
+            f.seek(begin)
+            yield json.loads(f.read(end - begin))
+
+
+def read_record(filename, i):
+    return next(iter_range(filename, i, i + 1))
@@ -0,0 +1,178 @@
+"""
+Reference-side artifacts shared by every RAG version: the Stack Overflow reference answers and the
+questions are the same in all test versions, so their tokens, n-gram counts, code features (03 non-LLM
+metrics) and question embeddings (02 answer_relevancy) are computed once and loaded by later runs.
+
+Artifacts are keyed by (Answer ID, kind, sha256 of the text, version); an edited reference, a changed
+tokenizer (ARTIFACT_VERSION) or another embedding model is a new key, never a stale hit.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import llm_telemetry
+import text_metrics
+
+REFERENCE_STORE_PATH = os.getenv("REFERENCE_STORE_PATH", "reference_store.sqlite")
+# Bump when text_metrics.reference_artifacts changes what it produces
+ARTIFACT_VERSION = "2"
+# langchain_openai's default, i.e. what ragas uses when evaluate() gets no embeddings
+QUESTION_EMBEDDING_MODEL = os.getenv("QUESTION_EMBEDDING_MODEL", "text-embedding-ada-002")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ReferenceStore:
+    def __init__(self, path=REFERENCE_STORE_PATH):
+        self.path = path
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # 03 的进程池里多个 worker 会同时写，timeout 让写锁排队而不是报错
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                answer_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (answer_id, kind, text_hash, version)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload FROM artifacts WHERE answer_id = ? AND kind = ? AND text_hash = ? AND version = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        found = {}
+        for key in set(keys):
+            payload = self.get(key)
+            if payload is not None:
+                found[key] = payload
+        return found
+
+    def put_many(self, items):
+        """ Stores {key: payload} in one transaction. """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(*key, payload, now) for key, payload in items.items()])
+            self.conn.commit()
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    # fork 出来的 worker 不能复用父进程的 sqlite 连接
+    if _store is None or _store.pid != os.getpid():
+        _store = ReferenceStore()
+    return _store
+
+
+def artifact_key(item, kind, text, version):
+    return (str(item.get("answer_id", "")), kind, text_hash(text), version)
+
+
+def reference_artifacts(data):
+    """
+    text_metrics.reference_artifacts of every entry's reference_answer, in input order.
+    Only references missing from the store are tokenized; they are stored for the next run.
+    """
+    store = get_store()
+    references = [item.get("reference_answer") or "" for item in data]
+    keys = [artifact_key(item, "nonllm", reference, ARTIFACT_VERSION) for item, reference in zip(data, references)]
+    found = {key: json.loads(zlib.decompress(payload)) for key, payload in store.get_many(keys).items()}
+
+    tokenizer = text_metrics.RougeTokenizer()
+    computed = {}
+    for key, reference in zip(keys, references):
+        if key not in found and key not in computed:
+            computed[key] = text_metrics.reference_artifacts(reference, tokenizer)
+    if computed:
+        # n-gram 计数的 JSON 重复很多，压缩后约为原来的 1/4
+        store.put_many({key: zlib.compress(json.dumps(artifact, ensure_ascii=False).encode("utf-8"))
+                        for key, artifact in computed.items()})
+    print(f"Reference artifacts: {len(found)} reused from {store.path}, {len(computed)} computed")
+
+    found.update(computed)
+    return [found[key] for key in keys]
+
+
+def load_question_embeddings(data, model=QUESTION_EMBEDDING_MODEL):
+    """ Returns ({text hash: vector} of the stored question embeddings, {text hash: key} of all questions). """
+    store = get_store()
+    keys = {}
+    for item in data:
+        key = artifact_key(item, "question_embedding", item["question"], model)
+        keys[key[2]] = key
+    vectors = {key[2]: np.frombuffer(payload, dtype=np.float64).tolist()
+               for key, payload in store.get_many(keys.values()).items()}
+    return vectors, keys
+
+
+def question_embeddings(data, model=QUESTION_EMBEDDING_MODEL):
+    """
+    langchain Embeddings for ragas.evaluate(embeddings=...): the questions of `data` come from the
+    store (new ones are embedded once and stored); every other text, e.g. answer_relevancy's generated
+    questions, goes to OpenAI as usual.
+    """
+    from langchain_core.embeddings import Embeddings
+    from langchain_openai import OpenAIEmbeddings
+
+    store = get_store()
+    vectors, keys = load_question_embeddings(data, model)
+    print(f"Question embeddings: {len(vectors)} of {len(keys)} reused from {store.path}")
+
+    class ReferenceEmbeddings(Embeddings):
+        def __init__(self):
+            self.inner = OpenAIEmbeddings(model=model)
+
+        def _cached(self, text):
+            vector = vectors.get(text_hash(text))
+            if vector is not None:
+                llm_telemetry.count("question_embeddings_reused")
+            return vector
+
+        def _remember(self, text, vector):
+            key = keys.get(text_hash(text))
+            if key is not None:
+                vectors[key[2]] = vector
+                store.put_many({key: np.asarray(vector, dtype=np.float64).tobytes()})
+
+        def embed_query(self, text):
+            vector = self._cached(text)
+            if vector is None:
+                vector = self.inner.embed_query(text)
+                self._remember(text, vector)
+            return vector
+
+        async def aembed_query(self, text):
+            vector = self._cached(text)
+            if vector is None:
+                vector = await self.inner.aembed_query(text)
+                self._remember(text, vector)
+            return vector
+
+        def embed_documents(self, texts):
+            return self.inner.embed_documents(texts)
+
+        async def aembed_documents(self, texts):
+            return await self.inner.aembed_documents(texts)
+
+    return ReferenceEmbeddings()
@@ -0,0 +1,74 @@
+import json
+import os
+
+
+def journal_filename(output_filename):
+    """ Journal sits next to the final output: test_5_ragas_scores.json -> test_5_ragas_scores.json.journal.jsonl """
+    return output_filename + ".journal.jsonl"
+
+
+def sample_key(position, item):
+    """ Question ID / Answer ID when the entry has them, else its row position in the input file. """
+    if "question_id" in item and "answer_id" in item:
+        return f"{item['question_id']}/{item['answer_id']}"
+    return f"row-{position}"
+
+
+class ResultJournal:
+    """
+    Append-only JSONL log of finished samples, one {"key": ..., "result": ...} per line.
+    Every append is flushed and fsynced, so a crash loses at most the sample being written;
+    a torn last line is ignored on load.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        if not resume and os.path.exists(filename):
+            os.remove(filename)
+        self.results = self._load()
+        self.file = open(filename, "a", encoding="utf-8")
+        if self._ends_with_torn_line():
+            self.file.write("\n")  # 新记录不能接在半行后面
+
+    def _ends_with_torn_line(self):
+        if not os.path.getsize(self.filename):
+            return False
+        with open(self.filename, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _load(self):
+        results = {}
+        if not os.path.exists(self.filename):
+            return results
+        with open(self.filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 崩溃时写了一半的最后一行
+                results[record["key"]] = record["result"]
+        return results
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, key, default=None):
+        return self.results.get(key, default)
+
+    def append(self, key, result):
+        self.file.write(json.dumps({"key": key, "result": result}, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.results[key] = result
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        """ Closes and deletes the journal, once its results are safely in the final output. """
+        self.close()
+        os.remove(self.filename)
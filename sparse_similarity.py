@@ -0,0 +1,177 @@
+"""
+Offline sparse-vector similarity: a BM25 (or TF-IDF) vocabulary fitted once over the Kubernetes
+corpus (questions, reference answers, retrieved contexts), then every response-reference and
+response-context cosine of a file computed as sparse matrix products. No network, no cost.
+
+    python answer_eval.py sparse-fit test_verification_results_v*processed_data.jsonl   # -> sparse_vocab.json
+    python answer_eval.py score-nollm v4processed_data.jsonl --sparse-vocab sparse_vocab.json
+
+Tokens are text_metrics' ROUGE tokens (lowercase alphanumerics, Porter-stemmed), so the reference
+side can come straight from reference_store. scipy is needed only here.
+"""
+import json
+from collections import Counter
+
+import numpy as np
+
+import text_metrics
+from data_io import iter_records
+
+SPARSE_VOCAB_FILENAME = "sparse_vocab.json"
+WEIGHTINGS = ("bm25", "tfidf")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class SparseModel:
+    """ Vocabulary + document frequencies of the fitted corpus; turns token lists into L2-normalized rows. """
+
+    def __init__(self, document_frequency, documents, average_length, weighting="bm25", k1=BM25_K1, b=BM25_B):
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown weighting {weighting!r}, expected one of {WEIGHTINGS}")
+        self.document_frequency = document_frequency
+        self.documents = documents
+        self.average_length = average_length
+        self.weighting = weighting
+        self.k1 = k1
+        self.b = b
+        self.term_ids = {term: i for i, term in enumerate(document_frequency)}
+        df = np.asarray(list(document_frequency.values()), dtype=np.float64)
+        if weighting == "bm25":
+            self.idf = np.log1p((documents - df + 0.5) / (df + 0.5))
+        else:
+            # sklearn 的 smooth idf
+            self.idf = np.log((1 + documents) / (1 + df)) + 1
+
+    @classmethod
+    def fit(cls, token_lists, weighting="bm25", min_df=1, **kwargs):
+        document_frequency = Counter()
+        total_length = 0
+        for tokens in token_lists:
+            document_frequency.update(set(tokens))
+            total_length += len(tokens)
+        documents = len(token_lists)
+        terms = {term: df for term, df in sorted(document_frequency.items()) if df >= min_df}
+        return cls(terms, documents, total_length / max(documents, 1), weighting, **kwargs)
+
+    def to_json(self):
+        return {
+            "weighting": self.weighting,
+            "k1": self.k1,
+            "b": self.b,
+            "documents": self.documents,
+            "average_length": self.average_length,
+            "document_frequency": self.document_frequency,
+        }
+
+    def save(self, filename=SPARSE_VOCAB_FILENAME):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False)
+        print(f"Sparse vocabulary ({self.weighting}, {len(self.term_ids)} terms, {self.documents} documents) "
+              f"saved to {filename}")
+        return filename
+
+    @classmethod
+    def load(cls, filename=SPARSE_VOCAB_FILENAME):
+        with open(filename, "r", encoding="utf-8") as f:
+            model = json.load(f)
+        return cls(model["document_frequency"], model["documents"], model["average_length"],
+                   model["weighting"], model["k1"], model["b"])
+
+    def transform(self, token_lists):
+        """ CSR matrix with one L2-normalized row per token list; out-of-vocabulary tokens are ignored. """
+        from scipy import sparse
+
+        indptr, indices, counts, lengths = [0], [], [], []
+        for tokens in token_lists:
+            row = Counter(self.term_ids[token] for token in tokens if token in self.term_ids)
+            indices.extend(row.keys())
+            counts.extend(row.values())
+            indptr.append(len(indices))
+            lengths.append(len(tokens))
+        indices = np.asarray(indices, dtype=np.int64)
+        tf = np.asarray(counts, dtype=np.float64)
+        row_of = np.repeat(np.arange(len(lengths)), np.diff(indptr))
+
+        if self.weighting == "bm25":
+            length_norm = 1 - self.b + self.b * np.asarray(lengths, dtype=np.float64)[row_of] / max(self.average_length, 1e-9)
+            weights = self.idf[indices] * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        else:
+            weights = self.idf[indices] * (1 + np.log(tf))
+
+        norms = np.sqrt(np.bincount(row_of, weights=weights ** 2, minlength=len(lengths)))
+        weights = weights / np.where(norms > 0, norms, 1)[row_of]
+        return sparse.csr_matrix((weights, indices, np.asarray(indptr)), shape=(len(lengths), len(self.term_ids)))
+
+
+def tokenize_all(texts, tokenizer=None):
+    tokenizer = tokenizer or text_metrics.RougeTokenizer()
+    return [tokenizer.stem_tokens(text or "") for text in texts]
+
+
+def corpus_documents(filenames):
+    """ Distinct questions, reference answers and retrieved contexts of the processed files. """
+    documents = {}
+    for filename in filenames:
+        for item in iter_records(filename):
+            for text in [item.get("question"), item.get("reference_answer"), *(item.get("retrieved_contexts") or [])]:
+                if text:
+                    documents.setdefault(text, None)
+    return list(documents)
+
+
+def fit_files(filenames, output_filename=SPARSE_VOCAB_FILENAME, weighting="bm25", min_df=1):
+    """ Fits the vocabulary over the corpus of the processed `filenames` and saves it. """
+    documents = corpus_documents(filenames)
+    model = SparseModel.fit(tokenize_all(documents), weighting=weighting, min_df=min_df)
+    model.save(output_filename)
+    return model
+
+
+_models = {}
+
+
+def get_model(filename=SPARSE_VOCAB_FILENAME):
+    """ Loaded once per process (03's pool workers each load it on their first chunk). """
+    if filename not in _models:
+        _models[filename] = SparseModel.load(filename)
+    return _models[filename]
+
+
+def rowwise_cosine(a, b):
+    """ Cosine of row i of `a` with row i of `b` (both L2-normalized), for all rows at once. """
+    return np.asarray(a.multiply(b).sum(axis=1)).ravel()
+
+
+def similarity_scores(model, responses, references, contexts, reference_tokens=None):
+    """
+    Per row: cosine of the response with the reference answer, and the highest cosine of the response
+    with any of its retrieved contexts (0.0 for rows without contexts, e.g. the baseline).
+    """
+    tokenizer = text_metrics.RougeTokenizer()
+    response_matrix = model.transform(tokenize_all(responses, tokenizer))
+    if reference_tokens is None:
+        reference_tokens = tokenize_all(references, tokenizer)
+    reference_similarity = rowwise_cosine(response_matrix, model.transform(reference_tokens))
+
+    # 所有 context 叠成一个矩阵，和各自所属行的回答逐行相乘，再按行取最大值
+    owners = np.asarray([row for row, row_contexts in enumerate(contexts) for _ in row_contexts], dtype=np.int64)
+    context_similarity = np.zeros(len(responses), dtype=np.float64)
+    if len(owners):
+        context_matrix = model.transform(tokenize_all([c for row_contexts in contexts for c in row_contexts], tokenizer))
+        np.maximum.at(context_similarity, owners, rowwise_cosine(response_matrix[owners], context_matrix))
+    return {
+        "sparse_reference_similarity": reference_similarity,
+        "sparse_context_similarity": context_similarity,
+    }
+
+
+def score_records(data, filename=SPARSE_VOCAB_FILENAME, reference_tokens=None):
+    """ similarity_scores for processed entries, with the model loaded from `filename`. """
+    return similarity_scores(
+        get_model(filename),
+        [item["generated_response"] for item in data],
+        [item.get("reference_answer") or "" for item in data],
+        [item.get("retrieved_contexts") or [] for item in data],
+        reference_tokens,
+    )
@@ -0,0 +1,365 @@
+"""
+Batch non-LLM text metrics for 03_ragas_noLLM: BLEU, ROUGE-L and normalized Levenshtein similarity
+for a whole corpus at once, with the same definitions as ragas' BleuScore / RougeScore /
+NonLLMStringSimilarity (sacrebleu 13a BLEU, rouge_score ROUGE-L F-measure with the Porter stemmer,
+rapidfuzz normalized Levenshtein).
+
+    scores = text_metrics.score_corpus(references, responses)   # {"bleu_score": array, ...}
+
+The corpus is tokenized once (every distinct word is stemmed once), n-grams become integer ids and
+BLEU's clipped counts are computed with numpy for all rows together; LCS and edit distance use
+bit-parallel algorithms. rapidfuzz (installed with ragas) computes the edit distance when available.
+"""
+import re
+from collections import Counter
+
+import numpy as np
+
+import code_similarity
+
+MAX_NGRAM_ORDER = 4
+
+# ---------------------------------------------------------------------------------------------
+# BLEU: sacrebleu corpus_bleu, 13a tokenizer, exp smoothing
+# ---------------------------------------------------------------------------------------------
+
+_tokenizer_13a = None
+
+
+def tokenize_13a(line):
+    """ sacrebleu's default (mteval-v13a) tokenizer, split into tokens. """
+    global _tokenizer_13a
+    if _tokenizer_13a is None:
+        from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
+        _tokenizer_13a = Tokenizer13a()
+    return _tokenizer_13a(line).split()
+
+
+def bleu_segments(reference, response):
+    """
+    (hypothesis, reference sentences) that ragas' BleuScore actually scores for one row. ragas passes
+    response.split(". ") as hypotheses and one reference stream per reference sentence; sacrebleu
+    zips the streams into a single reference set, so only the first response sentence is scored.
+    """
+    return response.split(". ")[0], reference.split(". ")
+
+
+def _ngram_ids(ids, remaining, vocab_size):
+    """ Per order 1..4: id of the n-gram starting at each position, -1 where it crosses a segment end. """
+    grams = [ids]
+    current = ids
+    for n in range(2, MAX_NGRAM_ORDER + 1):
+        positions = np.flatnonzero(remaining >= n)
+        # (n-1)-gram id 和下一个 token 组成 n-gram，再压缩成连续 id，避免 int64 溢出
+        pairs = current[positions] * vocab_size + ids[positions + n - 1]
+        current = np.full(len(ids), -1, dtype=np.int64)
+        current[positions] = np.unique(pairs, return_inverse=True)[1]
+        grams.append(current)
+    return grams
+
+
+def _clipped_matches(hyp_rows, hyp_grams, ref_rows, ref_segments, ref_grams, n_rows):
+    """ Per row: sum over hypothesis n-grams of min(count, max count in any single reference sentence). """
+    matches = np.zeros(n_rows, dtype=np.int64)
+    if not len(hyp_grams) or not len(ref_grams):
+        return matches
+    width = int(max(hyp_grams.max(), ref_grams.max())) + 1
+    hyp_keys, hyp_counts = np.unique(hyp_rows * width + hyp_grams, return_counts=True)
+
+    segment_keys, first, segment_counts = np.unique(ref_segments * width + ref_grams,
+                                                    return_index=True, return_counts=True)
+    row_keys = ref_rows[first] * width + segment_keys % width
+    order = np.argsort(row_keys, kind="stable")
+    row_keys, segment_counts = row_keys[order], segment_counts[order]
+    starts = np.flatnonzero(np.r_[True, row_keys[1:] != row_keys[:-1]])
+    ref_keys = row_keys[starts]
+    ref_max = np.maximum.reduceat(segment_counts, starts)
+
+    position = np.minimum(np.searchsorted(ref_keys, hyp_keys), len(ref_keys) - 1)
+    clipped = np.where(ref_keys[position] == hyp_keys, np.minimum(hyp_counts, ref_max[position]), 0)
+    np.add.at(matches, hyp_keys // width, clipped)
+    return matches
+
+
+def _bleu_from_counts(sys_len, ref_len, correct, total):
+    """ sacrebleu compute_bleu, one row per element. """
+    precisions = np.zeros(correct.shape, dtype=np.float64)
+    smooth = np.ones(len(sys_len), dtype=np.float64)
+    for n in range(MAX_NGRAM_ORDER):
+        has = total[:, n] > 0
+        zero = has & (correct[:, n] == 0)
+        smooth = np.where(zero, smooth * 2, smooth)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precisions[:, n] = np.where(zero, 100.0 / (smooth * total[:, n]),
+                                        np.where(has, 100.0 * correct[:, n] / total[:, n], 0.0))
+    with np.errstate(divide="ignore"):
+        logs = np.where(precisions > 0, np.log(np.where(precisions > 0, precisions, 1.0)), -9999999999.0)
+        brevity = np.where(sys_len >= ref_len, 1.0,
+                           np.where(sys_len > 0, np.exp(1 - ref_len / np.maximum(sys_len, 1)), 0.0))
+    # sacrebleu 在没有任何 n-gram 命中时直接返回 0（不做平滑）
+    return np.where(correct.any(axis=1), brevity * np.exp(logs.sum(axis=1) / MAX_NGRAM_ORDER) / 100, 0.0)
+
+
+def bleu_scores(references, responses):
+    """ ragas BleuScore for every (reference, response) row. """
+    n_rows = len(references)
+    vocab = {}
+    ids, segment_rows, segment_lengths, segment_is_hyp = [], [], [], []
+    for row, (reference, response) in enumerate(zip(references, responses)):
+        hypothesis, sentences = bleu_segments(reference, response)
+        for is_hyp, segment in [(True, hypothesis)] + [(False, sentence) for sentence in sentences]:
+            tokens = tokenize_13a(segment)
+            ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+            segment_rows.append(row)
+            segment_lengths.append(len(tokens))
+            segment_is_hyp.append(is_hyp)
+
+    ids = np.asarray(ids, dtype=np.int64)
+    segment_rows = np.asarray(segment_rows, dtype=np.int64)
+    segment_lengths = np.asarray(segment_lengths, dtype=np.int64)
+    segment_is_hyp = np.asarray(segment_is_hyp, dtype=bool)
+    segment_of = np.repeat(np.arange(len(segment_lengths)), segment_lengths)
+    remaining = np.cumsum(segment_lengths)[segment_of] - np.arange(len(ids))
+    position_rows = segment_rows[segment_of]
+    position_is_hyp = segment_is_hyp[segment_of]
+
+    # 参考长度：与假设长度最接近的参考句子，平局取较短的
+    sys_len = segment_lengths[segment_is_hyp]
+    ref_rows = segment_rows[~segment_is_hyp]
+    ref_lengths = segment_lengths[~segment_is_hyp]
+    distance = np.abs(ref_lengths - sys_len[ref_rows])
+    order = np.lexsort((ref_lengths, distance, ref_rows))
+    first = np.flatnonzero(np.r_[True, ref_rows[order][1:] != ref_rows[order][:-1]])
+    ref_len = ref_lengths[order][first]
+
+    correct = np.zeros((n_rows, MAX_NGRAM_ORDER), dtype=np.int64)
+    total = np.maximum(sys_len[:, None] - np.arange(MAX_NGRAM_ORDER)[None, :], 0)
+    for n, grams in enumerate(_ngram_ids(ids, remaining, max(len(vocab), 1))):
+        hyp = position_is_hyp & (grams >= 0)
+        ref = ~position_is_hyp & (grams >= 0)
+        correct[:, n] = _clipped_matches(position_rows[hyp], grams[hyp], position_rows[ref],
+                                         segment_of[ref], grams[ref], n_rows)
+    return _bleu_from_counts(sys_len.astype(np.float64), ref_len.astype(np.float64), correct, total)
+
+
+def _ngram_counts(tokens, n):
+    return Counter(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def bleu_reference_counts(reference):
+    """ Reference side of BLEU for one row: sentence lengths and, per order, max n-gram count over sentences. """
+    sentences = [tokenize_13a(sentence) for sentence in reference.split(". ")]
+    ngrams = []
+    for n in range(1, MAX_NGRAM_ORDER + 1):
+        counts = Counter()
+        for tokens in sentences:
+            counts |= _ngram_counts(tokens, n)
+        ngrams.append(dict(counts))
+    return [len(tokens) for tokens in sentences], ngrams
+
+
+def bleu_scores_from_references(artifacts, responses):
+    """ Same as bleu_scores, with the reference side taken from precomputed reference_artifacts. """
+    n_rows = len(responses)
+    sys_len = np.zeros(n_rows, dtype=np.float64)
+    ref_len = np.zeros(n_rows, dtype=np.float64)
+    correct = np.zeros((n_rows, MAX_NGRAM_ORDER), dtype=np.int64)
+    total = np.zeros((n_rows, MAX_NGRAM_ORDER), dtype=np.int64)
+    for row, (artifact, response) in enumerate(zip(artifacts, responses)):
+        # 只有第一句回答参与打分（见 bleu_segments），所以这里每行的开销很小
+        hypothesis = tokenize_13a(response.split(". ")[0])
+        sys_len[row] = len(hypothesis)
+        ref_len[row] = min(artifact["bleu_lengths"], key=lambda length: (abs(length - len(hypothesis)), length))
+        for n, reference_counts in enumerate(artifact["bleu_ngrams"]):
+            counts = _ngram_counts(hypothesis, n + 1)
+            correct[row, n] = sum(min(count, reference_counts.get(gram, 0)) for gram, count in counts.items())
+            total[row, n] = max(len(hypothesis) - n, 0)
+    return _bleu_from_counts(sys_len, ref_len, correct, total)
+
+
+# ---------------------------------------------------------------------------------------------
+# ROUGE-L: rouge_score tokenizer + NLTK Porter stemmer (NLTK_EXTENSIONS mode)
+# ---------------------------------------------------------------------------------------------
+
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+class RougeTokenizer:
+    """ rouge_score's tokenizer with stemming; each distinct word is stemmed once and interned to an int. """
+
+    def __init__(self):
+        from nltk.stem import porter  # rouge_score 同样使用 nltk 的默认模式
+        self.stemmer = porter.PorterStemmer()
+        self.words = {}
+        self.stems = {}
+
+    def _stem(self, word):
+        stem = self.words.get(word)
+        if stem is None:
+            # rouge_score 只对长度 > 3 的词做词干化
+            stem = self.words[word] = self.stemmer.stem(word) if len(word) > 3 else word
+        return stem
+
+    def stem_tokens(self, text):
+        """ Stemmed tokens as strings (what the reference store keeps). """
+        return [self._stem(word) for word in _NON_ALPHANUMERIC.sub(" ", text.lower()).split()]
+
+    def intern(self, stems):
+        return [self.stems.setdefault(stem, len(self.stems)) for stem in stems]
+
+    def tokenize(self, text):
+        return self.intern(self.stem_tokens(text))
+
+
+def lcs_length(a, b):
+    """ Length of the longest common subsequence of two sequences (bit-parallel, Hyyrö 2004). """
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return 0
+    masks = {}
+    for i, item in enumerate(b):
+        masks[item] = masks.get(item, 0) | (1 << i)
+    full = (1 << len(b)) - 1
+    v = full
+    for item in a:
+        match = masks.get(item)
+        if match:
+            u = v & match
+            v = ((v + u) | (v - u)) & full
+    return len(b) - v.bit_count()
+
+
+def rouge_l_scores(references, responses, reference_tokens=None):
+    """
+    ragas RougeScore (rougeL, fmeasure) for every (reference, response) row.
+    `reference_tokens` (stemmed tokens per row, e.g. from the reference store) skips tokenizing the references.
+    """
+    tokenizer = RougeTokenizer()
+    scores = np.zeros(len(responses), dtype=np.float64)
+    for row, response in enumerate(responses):
+        if reference_tokens is not None:
+            target = tokenizer.intern(reference_tokens[row])
+        else:
+            target = tokenizer.tokenize(references[row])
+        prediction = tokenizer.tokenize(response)
+        if not target or not prediction:
+            continue
+        lcs = lcs_length(target, prediction)
+        precision, recall = lcs / len(prediction), lcs / len(target)
+        if precision + recall > 0:
+            scores[row] = 2 * precision * recall / (precision + recall)
+    return scores
+
+
+# ---------------------------------------------------------------------------------------------
+# Normalized Levenshtein similarity: 1 - distance / max(len)
+# ---------------------------------------------------------------------------------------------
+
+def levenshtein_distance(a, b):
+    """ Character edit distance (bit-parallel, Myers 1999 / Hyyrö 2003). """
+    # 公共前后缀不影响编辑距离，先去掉
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    a, b = a[prefix:], b[prefix:]
+    suffix = 0
+    limit = min(len(a), len(b))
+    while suffix < limit and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    if suffix:
+        a, b = a[:-suffix], b[:-suffix]
+
+    if len(a) < len(b):
+        a, b = b, a
+    m = len(b)
+    if m == 0:
+        return len(a)
+    peq = {}
+    for i, char in enumerate(b):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for char in a:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+_rapidfuzz = None
+
+
+def _get_rapidfuzz():
+    global _rapidfuzz
+    if _rapidfuzz is None:
+        try:
+            from rapidfuzz import process
+            from rapidfuzz.distance import Levenshtein
+            _rapidfuzz = (process, Levenshtein)
+        except ImportError:
+            _rapidfuzz = False
+    return _rapidfuzz
+
+
+def string_similarity_scores(references, responses):
+    """ ragas NonLLMStringSimilarity (Levenshtein) for every (reference, response) row. """
+    rapidfuzz = _get_rapidfuzz()
+    if rapidfuzz and hasattr(rapidfuzz[0], "cpdist"):
+        process, Levenshtein = rapidfuzz
+        distances = process.cpdist(references, responses, scorer=Levenshtein.normalized_distance,
+                                   dtype=np.float64, workers=-1)
+        return 1 - np.asarray(distances, dtype=np.float64)
+    return np.asarray([
+        1 - levenshtein_distance(reference, response) / max(len(reference), len(response))
+        if reference or response else 1.0
+        for reference, response in zip(references, responses)
+    ], dtype=np.float64)
+
+
+# ---------------------------------------------------------------------------------------------
+# Reference-side artifacts (cached across RAG versions by reference_store)
+# ---------------------------------------------------------------------------------------------
+
+def reference_artifacts(reference, tokenizer=None):
+    """ Everything the non-LLM metrics need from a reference answer, independent of the response. """
+    reference = reference or ""
+    bleu_lengths, bleu_ngrams = bleu_reference_counts(reference)
+    return {
+        "bleu_lengths": bleu_lengths,
+        "bleu_ngrams": bleu_ngrams,
+        "rouge_tokens": (tokenizer or RougeTokenizer()).stem_tokens(reference),
+        "code_features": code_similarity.code_features(reference),
+    }
+
+
+def score_corpus(references, responses, artifacts=None):
+    """
+    All three metrics for every row, keyed by 03_ragas_noLLM's output field names.
+    With `artifacts` (reference_artifacts per row), the reference side is not tokenized again.
+    """
+    references = [reference or "" for reference in references]
+    responses = [response or "" for response in responses]
+    if artifacts is None:
+        bleu = bleu_scores(references, responses)
+        rouge = rouge_l_scores(references, responses)
+    else:
+        bleu = bleu_scores_from_references(artifacts, responses)
+        rouge = rouge_l_scores(references, responses, [artifact["rouge_tokens"] for artifact in artifacts])
+    return {
+        "nonllm_string_similarity": string_similarity_scores(references, responses),
+        "bleu_score": bleu,
+        "rouge_score": rouge,
+    }